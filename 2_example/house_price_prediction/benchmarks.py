@@ -0,0 +1,259 @@
+"""
+Benchmarking the House Price Prediction Helpers
+------------------------------------------------
+
+Run this module directly to time the data generation and splitting helpers at different dataset sizes:
+
+.. code-block:: bash
+
+    python benchmarks.py
+"""
+
+# %%
+# Importing the Libraries
+# =======================
+import io
+import os
+import tempfile
+import time
+import tracemalloc
+import typing
+
+import numpy as np
+import pandas as pd
+from flytekit.core.context_manager import FlyteContextManager
+from flytekit.core.type_engine import TypeEngine
+from flytekit.models.literals import Literal
+from flyteidl.core import literals_pb2
+from sklearn.model_selection import train_test_split
+
+try:
+    from .house_price_predictor import (
+        COLUMNS,
+        MAX_YEAR,
+        SPLIT_RATIOS,
+        NumpyFile,
+        gen_houses,
+        split_data,
+    )
+except ImportError:
+    from house_price_predictor import (
+        COLUMNS,
+        MAX_YEAR,
+        SPLIT_RATIOS,
+        NumpyFile,
+        gen_houses,
+        split_data,
+    )
+
+
+# %%
+# Reference Implementations
+# =========================
+#
+# The original row-by-row data generator, kept around so the vectorized one can be compared against it.
+def gen_houses_loop(num_houses: int) -> pd.DataFrame:
+    _house_list = []
+    for _ in range(num_houses):
+        _house = {
+            "SQUARE_FEET": int(np.random.normal(3000, 750)),
+            "NUM_BEDROOMS": np.random.randint(2, 7),
+            "NUM_BATHROOMS": np.random.randint(2, 7) / 2,
+            "LOT_ACRES": round(np.random.normal(1.0, 0.25), 2),
+            "GARAGE_SPACES": np.random.randint(0, 4),
+            "YEAR_BUILT": min(MAX_YEAR, int(np.random.normal(1995, 10))),
+        }
+        _price = int(
+            int(_house["SQUARE_FEET"] * 150)
+            + (10000 * _house["NUM_BEDROOMS"])
+            + (15000 * _house["NUM_BATHROOMS"])
+            + (15000 * _house["LOT_ACRES"])
+            + (15000 * _house["GARAGE_SPACES"])
+            - (5000 * (MAX_YEAR - _house["YEAR_BUILT"]))
+        )
+        _house_list.append(
+            [
+                _price,
+                _house["YEAR_BUILT"],
+                _house["SQUARE_FEET"],
+                _house["NUM_BEDROOMS"],
+                _house["NUM_BATHROOMS"],
+                _house["LOT_ACRES"],
+                _house["GARAGE_SPACES"],
+            ]
+        )
+    return pd.DataFrame(_house_list, columns=COLUMNS)
+
+
+# %%
+# The original splitter, which calls ``train_test_split`` twice on ``df.values`` and reassembles every split.
+def split_data_legacy(
+    df: pd.DataFrame, seed: int, split: typing.List[float]
+) -> typing.Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    val_size = split[1]
+    test_size = split[2]
+
+    x1 = df.values[:, 1:]
+    y1 = df.values[:, :1]
+
+    x_train, x_test, y_train, y_test = train_test_split(
+        x1, y1, test_size=test_size, random_state=seed
+    )
+    x_train, x_val, y_train, y_val = train_test_split(
+        x_train,
+        y_train,
+        test_size=(val_size / (1 - test_size)),
+        random_state=seed,
+    )
+
+    return tuple(
+        pd.DataFrame(np.concatenate([y, x], axis=1), columns=COLUMNS)
+        for y, x in ((y_train, x_train), (y_val, x_val), (y_test, x_test))
+    )
+
+
+# %%
+# Timing Helpers
+# ==============
+def timed(fn: typing.Callable, *args, **kwargs) -> typing.Tuple[float, typing.Any]:
+    _start = time.perf_counter()
+    _result = fn(*args, **kwargs)
+    return time.perf_counter() - _start, _result
+
+
+# %%
+# NumPy reports its allocations to ``tracemalloc``, so the traced peak covers the arrays behind the DataFrames.
+def peak_memory(fn: typing.Callable, *args, **kwargs) -> typing.Tuple[int, typing.Any]:
+    tracemalloc.start()
+    try:
+        _result = fn(*args, **kwargs)
+        _, _peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return _peak, _result
+
+
+def mib(num_bytes: int) -> str:
+    return f"{num_bytes / 2 ** 20:.1f}"
+
+
+# %%
+# Benchmark: Generating the Data
+# ==============================
+#
+# The row-by-row generator is only timed up to ``max_loop_rows`` houses, since it takes minutes beyond that.
+def bench_gen_houses(
+    sizes: typing.List[int] = (10_000, 100_000, 1_000_000, 10_000_000),
+    max_loop_rows: int = 1_000_000,
+):
+    print(f"{'rows':>12} {'loop (s)':>10} {'vectorized (s)':>15} {'speedup':>8}")
+    for num_houses in sizes:
+        _vectorized, _ = timed(gen_houses, num_houses, seed=7)
+        if num_houses <= max_loop_rows:
+            _loop, _ = timed(gen_houses_loop, num_houses)
+            print(
+                f"{num_houses:>12} {_loop:>10.3f} {_vectorized:>15.3f} {_loop / _vectorized:>7.1f}x"
+            )
+        else:
+            print(f"{num_houses:>12} {'-':>10} {_vectorized:>15.3f} {'-':>8}")
+
+
+# %%
+# Benchmark: Splitting the Data
+# =============================
+#
+# Measures the memory allocated on top of the input DataFrame and checks that both splitters return the same rows.
+def bench_split_data(sizes: typing.List[int] = (1_000_000, 10_000_000, 50_000_000)):
+    print(
+        f"{'rows':>12} {'input (MiB)':>12} {'legacy peak (MiB)':>18} {'split_data peak (MiB)':>22}"
+    )
+    for num_houses in sizes:
+        _df = gen_houses(num_houses, seed=7)
+        _legacy_peak, _legacy = peak_memory(split_data_legacy, _df, 7, SPLIT_RATIOS)
+        del _legacy
+        _peak, _splits = peak_memory(split_data, _df, 7, SPLIT_RATIOS)
+        _sample = _df.head(10_000)
+        for _actual, _expected in zip(
+            split_data(_sample, 7, SPLIT_RATIOS),
+            split_data_legacy(_sample, 7, SPLIT_RATIOS),
+        ):
+            pd.testing.assert_frame_equal(_actual.astype(np.float64), _expected)
+        print(
+            f"{num_houses:>12} {mib(_df.memory_usage(deep=True).sum()):>12}"
+            f" {mib(_legacy_peak):>18} {mib(_peak):>22}"
+        )
+        del _df, _splits
+
+
+# %%
+# Report: Compact Dtype Schema
+# ============================
+#
+# Compares the houses stored with ``HOUSE_SCHEMA`` against the same houses as float64 columns (the dtype every
+# column used to end up with after splitting), both in memory and as the Parquet data passed between tasks.
+def parquet_size(df: pd.DataFrame) -> int:
+    _buffer = io.BytesIO()
+    df.to_parquet(_buffer, index=False)
+    return _buffer.getbuffer().nbytes
+
+
+def report_compact_schema(sizes: typing.List[int] = (1_000_000, 10_000_000)):
+    print(
+        f"{'rows':>12} {'float64 (MiB)':>14} {'compact (MiB)':>14}"
+        f" {'float64 parquet (MiB)':>22} {'compact parquet (MiB)':>22}"
+    )
+    for num_houses in sizes:
+        _compact = gen_houses(num_houses, seed=7)
+        _wide = _compact.astype(np.float64)
+        print(
+            f"{num_houses:>12} {mib(_wide.memory_usage(deep=True).sum()):>14}"
+            f" {mib(_compact.memory_usage(deep=True).sum()):>14}"
+            f" {mib(parquet_size(_wide)):>22} {mib(parquet_size(_compact)):>22}"
+        )
+
+
+# %%
+# Benchmark: Passing the Predictions Between Tasks
+# ================================================
+#
+# Round-trips the predictions through Flyte's type engine and the protobuf literal that is sent to the backend,
+# once as a ``List[float]`` (one literal per prediction) and once as a float32 ``.npy`` file. The list is only
+# round-tripped up to ``max_list_size`` predictions, since it takes minutes beyond that.
+def roundtrip(python_val: typing.Any, python_type: typing.Type) -> typing.Any:
+    ctx = FlyteContextManager.current_context()
+    literal = TypeEngine.to_literal(
+        ctx, python_val, python_type, TypeEngine.to_literal_type(python_type)
+    )
+    pb = literals_pb2.Literal()
+    pb.ParseFromString(literal.to_flyte_idl().SerializeToString())
+    return TypeEngine.to_python_value(ctx, Literal.from_flyte_idl(pb), python_type)
+
+
+def bench_prediction_transport(
+    sizes: typing.List[int] = (10_000, 1_000_000, 10_000_000),
+    max_list_size: int = 1_000_000,
+):
+    print(f"{'predictions':>12} {'List[float] (s)':>16} {'npy file (s)':>13}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for num_predictions in sizes:
+            y_pred = np.random.default_rng(7).normal(450_000, 100_000, num_predictions)
+            y_pred = y_pred.astype(np.float32)
+
+            def npy_roundtrip():
+                fname = os.path.join(tmp, f"predictions-{num_predictions}.npy")
+                np.save(fname, y_pred)
+                return np.load(roundtrip(NumpyFile(fname), NumpyFile))
+
+            _npy, _ = timed(npy_roundtrip)
+            if num_predictions <= max_list_size:
+                _list, _ = timed(roundtrip, y_pred.tolist(), typing.List[float])
+                print(f"{num_predictions:>12} {_list:>16.3f} {_npy:>13.3f}")
+            else:
+                print(f"{num_predictions:>12} {'-':>16} {_npy:>13.3f}")
+
+
+if __name__ == "__main__":
+    bench_gen_houses()
+    bench_split_data()
+    report_compact_schema()
+    bench_prediction_transport()
@@ -19,15 +19,26 @@ Predicting House Price in a Region with XGBoost
 # First, import all the required libraries.
 import typing
 
+import hashlib
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
 import flytekit
 import joblib
 import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from dataclasses_json import dataclass_json
+import xgboost
 from xgboost import XGBRegressor
 from flytekit import Resources, task, workflow
-from flytekit.types.file import JoblibSerializedFile
+from flytekit.types.directory import FlyteDirectory
+from flytekit.types.file import FlyteFile, JoblibSerializedFile
 from typing import Tuple
 
 # %%
@@ -45,108 +56,325 @@ COLUMNS = [
     "LOT_ACRES",
     "GARAGE_SPACES",
 ]
+HOUSE_SCHEMA = {
+    "PRICE": np.int32,
+    "YEAR_BUILT": np.int16,
+    "SQUARE_FEET": np.int32,
+    "NUM_BEDROOMS": np.int16,
+    "NUM_BATHROOMS": np.float32,
+    "LOT_ACRES": np.float32,
+    "GARAGE_SPACES": np.int16,
+}
 MAX_YEAR = 2021
 SPLIT_RATIOS = [0.6, 0.3, 0.1]
+SPLIT_NAMES = ["train", "val", "test"]
+SPLIT_MODES = ["random", "stratified", "time"]
+NUM_PRICE_STRATA = 10
+CHUNK_SIZE = 500_000
+MODEL_CACHE_SIZE = 8
+PREDICT_BATCH_SIZE = 100_000
+
+# %%
+# The distributions the house features are drawn from. Regions can use different ones; the defaults describe
+# a typical region.
+@dataclass_json
+@dataclass
+class HouseDistribution(object):
+    square_feet_mean: float = 3000
+    square_feet_std: float = 750
+    lot_acres_mean: float = 1.0
+    lot_acres_std: float = 0.25
+    year_built_mean: float = 1995
+    year_built_std: float = 10
+    price_per_square_foot: int = 150
+
 
 # %%
 # Defining the Data Generation Functions
 # ======================================
 #
-# Define a function to generate the price of a house.
-def gen_price(house) -> int:
-    _base_price = int(house["SQUARE_FEET"] * 150)
-    _price = int(
+# Define a function to generate the price of a house. ``house`` maps each feature name to a NumPy array
+# (or a DataFrame column), so the prices of all the houses are computed at once.
+def gen_price(house, price_per_square_foot: int = 150) -> np.ndarray:
+    _base_price = (house["SQUARE_FEET"] * price_per_square_foot).astype(np.int64)
+    _price = (
         _base_price
         + (10000 * house["NUM_BEDROOMS"])
         + (15000 * house["NUM_BATHROOMS"])
         + (15000 * house["LOT_ACRES"])
         + (15000 * house["GARAGE_SPACES"])
         - (5000 * (MAX_YEAR - house["YEAR_BUILT"]))
-    )
+    ).astype(np.int64)
     return _price
 
 
+# %%
+# Define a function that draws every feature column for ``num_houses`` houses from a single random generator.
+# Each feature is drawn as a whole array, which is much faster than drawing one house at a time. The columns are
+# then narrowed to the compact dtypes of ``HOUSE_SCHEMA``, which take about a third of the memory of float64.
+def gen_house_columns(
+    num_houses: int,
+    rng: np.random.Generator,
+    distribution: typing.Optional[HouseDistribution] = None,
+) -> typing.Dict[str, np.ndarray]:
+    d = distribution or HouseDistribution()
+    _house = {
+        "SQUARE_FEET": rng.normal(
+            d.square_feet_mean, d.square_feet_std, num_houses
+        ).astype(np.int64),
+        "NUM_BEDROOMS": rng.integers(2, 7, num_houses),
+        "NUM_BATHROOMS": rng.integers(2, 7, num_houses) / 2,
+        "LOT_ACRES": np.round(
+            rng.normal(d.lot_acres_mean, d.lot_acres_std, num_houses), 2
+        ),
+        "GARAGE_SPACES": rng.integers(0, 4, num_houses),
+        "YEAR_BUILT": np.minimum(
+            MAX_YEAR,
+            rng.normal(d.year_built_mean, d.year_built_std, num_houses).astype(
+                np.int64
+            ),
+        ),
+    }
+    _house["PRICE"] = gen_price(_house, d.price_per_square_foot)
+    return {column: _house[column].astype(HOUSE_SCHEMA[column]) for column in COLUMNS}
+
+
 # %%
 # Define a function that returns a DataFrame object constituting all the houses' details.
-def gen_houses(num_houses) -> pd.DataFrame:
-    _house_list = []
-    for _ in range(num_houses):
-        _house = {
-            "SQUARE_FEET": int(np.random.normal(3000, 750)),
-            "NUM_BEDROOMS": np.random.randint(2, 7),
-            "NUM_BATHROOMS": np.random.randint(2, 7) / 2,
-            "LOT_ACRES": round(np.random.normal(1.0, 0.25), 2),
-            "GARAGE_SPACES": np.random.randint(0, 4),
-            "YEAR_BUILT": min(MAX_YEAR, int(np.random.normal(1995, 10))),
-        }
-        _price = gen_price(_house)
-        _house_list.append(
-            [
-                _price,
-                _house["YEAR_BUILT"],
-                _house["SQUARE_FEET"],
-                _house["NUM_BEDROOMS"],
-                _house["NUM_BATHROOMS"],
-                _house["LOT_ACRES"],
-                _house["GARAGE_SPACES"],
-            ]
-        )
-    _df = pd.DataFrame(
-        _house_list,
-        columns=COLUMNS,
-    )
+# The same seed always generates the same houses.
+def gen_houses(
+    num_houses: int,
+    seed: typing.Optional[int] = None,
+    distribution: typing.Optional[HouseDistribution] = None,
+) -> pd.DataFrame:
+    return _houses_frame(num_houses, np.random.default_rng(seed), distribution)
+
+
+def _houses_frame(
+    num_houses: int,
+    rng: np.random.Generator,
+    distribution: typing.Optional[HouseDistribution] = None,
+) -> pd.DataFrame:
+    _columns = gen_house_columns(num_houses, rng, distribution)
+    # The arrays are handed over to pandas as they are, without being copied
+    _df = pd.DataFrame(_columns, columns=COLUMNS, copy=False)
     return _df
 
 
 # %%
-# Split the data into train, val, and test datasets.
-def split_data(
-    df: pd.DataFrame, seed: int, split: typing.List[float]
-) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+# For datasets that don't fit in memory, define a generator that yields the houses in chunks of ``chunk_size`` rows.
+# All the chunks are drawn from the same random generator, so when ``chunk_size >= num_houses`` the single chunk
+# is identical to ``gen_houses(num_houses, seed)``.
+def iter_houses(
+    num_houses: int, seed: typing.Optional[int] = None, chunk_size: int = CHUNK_SIZE
+) -> typing.Iterator[pd.DataFrame]:
+    rng = np.random.default_rng(seed)
+    for start in range(0, num_houses, chunk_size):
+        yield _houses_frame(min(chunk_size, num_houses - start), rng)
+
 
-    seed = seed
+# %%
+# Compute the row indices of the train, val, and test datasets. Only the (cheap) integer indices are shuffled, never
+# the data itself. The test rows are cut first and the remaining rows are then cut into train and val, which gives
+# exactly the same rows as splitting twice with scikit-learn's ``train_test_split(..., random_state=seed)``.
+def split_indices(
+    num_samples: int, seed: int, split: typing.List[float]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
     val_size = split[1]
     test_size = split[2]
 
-    num_samples = df.shape[0]
-    x1 = df.values[
-        :num_samples, 1:
-    ]  # keep only the features, skip the target, all rows
-    y1 = df.values[:num_samples, :1]  # keep only the target, all rows
-
     # Use split ratios to divide up into train & test
-    x_train, x_test, y_train, y_test = train_test_split(
-        x1, y1, test_size=test_size, random_state=seed
-    )
+    num_test = int(np.ceil(test_size * num_samples))
+    permutation = np.random.RandomState(seed).permutation(num_samples)
+    _test = permutation[:num_test]
+    _rest = permutation[num_test:]
+
     # Of the remaining training samples, give proper ratio to train & validation
-    x_train, x_val, y_train, y_val = train_test_split(
-        x_train,
-        y_train,
-        test_size=(val_size / (1 - test_size)),
-        random_state=seed,
-    )
+    num_val = int(np.ceil((val_size / (1 - test_size)) * _rest.shape[0]))
+    permutation = np.random.RandomState(seed).permutation(_rest.shape[0])
+    _val = _rest[permutation[:num_val]]
+    _train = _rest[permutation[num_val:]]
 
-    # Reassemble the datasets with target in first column and features after that
-    _train = np.concatenate([y_train, x_train], axis=1)
-    _val = np.concatenate([y_val, x_val], axis=1)
-    _test = np.concatenate([y_test, x_test], axis=1)
+    return _train, _val, _test
 
-    return (
-        pd.DataFrame(
-            _train,
-            columns=COLUMNS,
-        ),
-        pd.DataFrame(
-            _val,
-            columns=COLUMNS,
-        ),
-        pd.DataFrame(
-            _test,
-            columns=COLUMNS,
-        ),
+
+# %%
+# Cut ``num_samples`` rows into consecutive train, val, and test parts according to the split ratios.
+def _cut_points(num_samples: int, split: typing.List[float]) -> np.ndarray:
+    return np.round(np.cumsum(split)[:-1] * num_samples).astype(np.int64)
+
+
+# %%
+# Stratified split: every stratum (for example, a price decile) is shuffled and cut separately, so each of the
+# train, val, and test datasets has the same distribution of strata.
+def stratified_split_indices(
+    strata: np.ndarray, seed: int, split: typing.List[float]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    order = np.argsort(strata, kind="stable")
+    boundaries = np.flatnonzero(np.diff(strata[order])) + 1
+    parts = ([], [], [])
+    for members in np.split(order, boundaries):
+        members = rng.permutation(members)
+        for part, indices in zip(
+            parts, np.split(members, _cut_points(members.shape[0], split))
+        ):
+            part.append(indices)
+    return tuple(np.concatenate(part) for part in parts)
+
+
+# %%
+# Time-based split: the oldest houses go to train, the following ones to val, and the newest ones to test.
+# Houses built in the same year keep their original order, so the split is deterministic.
+def time_split_indices(
+    years: np.ndarray, split: typing.List[float]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    order = np.argsort(years, kind="stable")
+    return tuple(np.split(order, _cut_points(order.shape[0], split)))
+
+
+# %%
+# Compute the split indices of a DataFrame for one of the ``SPLIT_MODES``.
+def get_split_indices(
+    df: pd.DataFrame, seed: int, split: typing.List[float], mode: str = "random"
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    if mode == "random":
+        return split_indices(df.shape[0], seed, split)
+    if mode == "stratified":
+        price_deciles = pd.qcut(
+            df["PRICE"], NUM_PRICE_STRATA, labels=False, duplicates="drop"
+        )
+        return stratified_split_indices(np.asarray(price_deciles), seed, split)
+    if mode == "time":
+        return time_split_indices(df["YEAR_BUILT"].to_numpy(), split)
+    raise ValueError(f"Invalid split mode {mode}, expected one of {SPLIT_MODES}")
+
+
+# %%
+# Split the data into train, val, and test datasets.
+# Every split is taken from the original DataFrame in a single pass, so the column dtypes are kept.
+def split_data(
+    df: pd.DataFrame, seed: int, split: typing.List[float], mode: str = "random"
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    return take_splits(df, get_split_indices(df, seed, split, mode))
+
+
+def take_splits(
+    df: pd.DataFrame, indices: Tuple[np.ndarray, np.ndarray, np.ndarray]
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    return tuple(df.take(_indices).reset_index(drop=True) for _indices in indices)
+
+
+# %%
+# Split indices are much smaller than the split datasets, so they can be stored and reused instead of the
+# datasets themselves. Define a function that hashes the content of a dataset, and functions that save and load
+# the split indices as int32 arrays, together with the dataset hash, seed, ratios, and mode they were computed for.
+def hash_dataset(df: pd.DataFrame) -> str:
+    _digest = hashlib.sha256(",".join(df.columns).encode())
+    _digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return _digest.hexdigest()
+
+
+def save_split_indices(
+    path: str,
+    indices: Tuple[np.ndarray, np.ndarray, np.ndarray],
+    dataset_hash: str,
+    seed: int,
+    split: typing.List[float],
+    mode: str,
+):
+    np.savez(
+        path,
+        **{
+            name: _indices.astype(np.int32)
+            for name, _indices in zip(SPLIT_NAMES, indices)
+        },
+        dataset_hash=np.array(dataset_hash),
+        seed=np.array(seed),
+        split=np.array(split),
+        mode=np.array(mode),
     )
 
 
+def load_split_indices(
+    path: typing.Union[str, os.PathLike],
+    dataset_hash: typing.Optional[str] = None,
+    seed: typing.Optional[int] = None,
+    split: typing.Optional[typing.List[float]] = None,
+    mode: typing.Optional[str] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    with np.load(path) as _npz:
+        _expected = {
+            "dataset": (dataset_hash, str(_npz["dataset_hash"])),
+            "seed": (seed, int(_npz["seed"])),
+            "split": (split, _npz["split"].tolist()),
+            "mode": (mode, str(_npz["mode"])),
+        }
+        for _name, (_value, _stored) in _expected.items():
+            if _value is not None and _value != _stored:
+                raise ValueError(
+                    f"Split indices in {path} were computed for a different {_name}"
+                )
+        return tuple(_npz[name] for name in SPLIT_NAMES)
+
+
+# %%
+# The file name of a set of split indices identifies everything they were computed for.
+def split_indices_name(
+    dataset_hash: str, seed: int, split: typing.List[float], mode: str
+) -> str:
+    _ratios = "-".join(f"{ratio:g}" for ratio in split)
+    return f"split-{mode}-{dataset_hash[:16]}-{seed}-{_ratios}.npz"
+
+
+# %%
+# Assign every row of a chunk to one of the splits, with probabilities given by the split ratios.
+# The assignment has its own random stream, so it doesn't change the generated houses.
+def assign_splits(
+    num_rows: int, rng: np.random.Generator, split: typing.List[float]
+) -> np.ndarray:
+    return rng.choice(len(split), size=num_rows, p=split).astype(np.int8)
+
+
+# %%
+# Stream the generated chunks into one Parquet file per split, appending every chunk as a new row group.
+# Only one chunk is held in memory at a time, so the peak memory depends on ``chunk_size`` and not on
+# ``num_houses``.
+def write_split_shards(
+    num_houses: int,
+    seed: int,
+    split: typing.List[float],
+    output_dir: str,
+    chunk_size: int = CHUNK_SIZE,
+) -> typing.List[str]:
+    split_rng = np.random.default_rng(np.random.SeedSequence(seed).spawn(1)[0])
+    split_dirs = [os.path.join(output_dir, name) for name in SPLIT_NAMES]
+    for split_dir in split_dirs:
+        os.makedirs(split_dir, exist_ok=True)
+    writers = []
+    try:
+        for chunk in iter_houses(num_houses, seed=seed, chunk_size=chunk_size):
+            labels = assign_splits(chunk.shape[0], split_rng, split)
+            if not writers:
+                schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+                for split_dir in split_dirs:
+                    writers.append(
+                        pq.ParquetWriter(
+                            os.path.join(split_dir, "part-00000.parquet"), schema
+                        )
+                    )
+            for label, writer in enumerate(writers):
+                writer.write_table(
+                    pa.Table.from_pandas(
+                        chunk[labels == label], schema=schema, preserve_index=False
+                    )
+                )
+    finally:
+        for writer in writers:
+            writer.close()
+    return split_dirs
+
+
 # %%
 # Task: Generating & Splitting the Data
 # =====================================
@@ -160,12 +388,140 @@ dataset = typing.NamedTuple(
 )
 
 
-@task(cache=True, cache_version="0.1", limits=Resources(mem="600Mi"))
+@task(cache=True, cache_version="0.4", limits=Resources(mem="600Mi"))
 def generate_and_split_data(number_of_houses: int, seed: int) -> dataset:
-    _houses = gen_houses(number_of_houses)
+    _houses = gen_houses(number_of_houses, seed=seed)
     return split_data(_houses, seed, split=SPLIT_RATIOS)
 
 
+# %%
+# Task: Generating the Data & Computing Reusable Split Indices
+# ============================================================
+#
+# Alternatively, generate the data once and compute only the split indices for it. Both tasks are cached, so
+# re-running the training with different settings reuses the same data and indices instead of re-splitting and
+# re-serializing three DataFrames. The indices are stored in an ``.npz`` file named after the dataset hash, seed,
+# split ratios, and mode, and the tasks that use them check all four.
+NPZFile = FlyteFile[typing.TypeVar("npz")]
+
+
+@task(cache=True, cache_version="0.2", limits=Resources(mem="600Mi"))
+def generate_houses(number_of_houses: int, seed: int) -> pd.DataFrame:
+    return gen_houses(number_of_houses, seed=seed)
+
+
+@task(cache=True, cache_version="0.2", limits=Resources(mem="600Mi"))
+def build_split_indices(houses: pd.DataFrame, seed: int, split_mode: str) -> NPZFile:
+    dataset_hash = hash_dataset(houses)
+    working_dir = flytekit.current_context().working_directory
+    fname = os.path.join(
+        working_dir, split_indices_name(dataset_hash, seed, SPLIT_RATIOS, split_mode)
+    )
+    save_split_indices(
+        fname,
+        get_split_indices(houses, seed, SPLIT_RATIOS, split_mode),
+        dataset_hash=dataset_hash,
+        seed=seed,
+        split=SPLIT_RATIOS,
+        mode=split_mode,
+    )
+    return fname
+
+
+# %%
+# Task: Generating & Splitting the Data in Chunks
+# ===============================================
+#
+# The streaming variant of the previous task. It writes the splits to Parquet shards and returns one directory per
+# split, so datasets far larger than the memory limit can be generated. Read a split back with
+# ``pd.read_parquet(directory.download())``.
+streaming_dataset = typing.NamedTuple(
+    "GenerateSplitDataStreamingOutputs",
+    train_data=FlyteDirectory,
+    val_data=FlyteDirectory,
+    test_data=FlyteDirectory,
+)
+
+
+@task(cache=True, cache_version="0.2", limits=Resources(mem="600Mi"))
+def generate_and_split_data_streaming(
+    number_of_houses: int, seed: int, chunk_size: int = CHUNK_SIZE
+) -> streaming_dataset:
+    working_dir = flytekit.current_context().working_directory
+    split_dirs = write_split_shards(
+        number_of_houses,
+        seed,
+        split=SPLIT_RATIOS,
+        output_dir=os.path.join(working_dir, "houses"),
+        chunk_size=chunk_size,
+    )
+    return tuple(FlyteDirectory(path=split_dir) for split_dir in split_dirs)
+
+
+# %%
+# Task: Generating & Splitting the Data as Arrow Files
+# ====================================================
+#
+# DataFrames are passed between tasks as Parquet and fully converted to and from pandas on both ends. Arrow IPC
+# (Feather) files can be memory-mapped instead. Written uncompressed and as a single record batch, every column of
+# the file can be read as a NumPy array that points straight into the mapped file, without any copy.
+ArrowFile = FlyteFile[typing.TypeVar("arrow")]
+
+
+def write_arrow(df: pd.DataFrame, path: str) -> str:
+    feather.write_feather(
+        df, path, compression="uncompressed", chunksize=max(df.shape[0], 1)
+    )
+    return path
+
+
+def read_arrow(path: typing.Union[str, os.PathLike]) -> pa.Table:
+    return feather.read_table(os.fspath(path), memory_map=True)
+
+
+arrow_dataset = typing.NamedTuple(
+    "GenerateSplitDataArrowOutputs",
+    train_data=ArrowFile,
+    val_data=ArrowFile,
+    test_data=ArrowFile,
+)
+
+
+@task(cache=True, cache_version="0.3", limits=Resources(mem="600Mi"))
+def generate_and_split_data_arrow(
+    number_of_houses: int,
+    seed: int,
+    distribution: HouseDistribution = HouseDistribution(),
+) -> arrow_dataset:
+    _houses = gen_houses(number_of_houses, seed=seed, distribution=distribution)
+    working_dir = flytekit.current_context().working_directory
+    return tuple(
+        write_arrow(_split, os.path.join(working_dir, f"{name}.arrow"))
+        for name, _split in zip(
+            SPLIT_NAMES, split_data(_houses, seed, split=SPLIT_RATIOS)
+        )
+    )
+
+
+# %%
+# XGBoost works on float32 matrices. Define a function that converts the features (all columns after the first one)
+# straight to float32, instead of letting the mixed column dtypes be upcast to float64 first, and returns them along
+# with the target (the first column). Arrow tables are read column by column through zero-copy NumPy views, so the
+# float32 matrix is the only copy of the data.
+def features_and_target(
+    df: typing.Union[pd.DataFrame, pa.Table, pa.RecordBatch],
+) -> Tuple[np.ndarray, np.ndarray]:
+    if isinstance(df, (pa.Table, pa.RecordBatch)):
+        x = np.empty((df.num_rows, df.num_columns - 1), dtype=np.float32)
+        for i, column in enumerate(df.columns[1:]):
+            x[:, i] = column.to_numpy()
+        y = df.column(0).to_numpy().astype(np.float32, copy=False)
+        return x, y
+    x = df[df.columns[1:]].to_numpy(dtype=np.float32)
+    y = df[df.columns[0]].to_numpy(dtype=np.float32)
+    return x, y
+
+
 # %%
 # Task: Training the XGBoost Model
 # ================================
@@ -173,47 +529,356 @@ def generate_and_split_data(number_of_houses: int, seed: int) -> dataset:
 # Serialize the XGBoost model using joblib and store the model in a dat file.
 @task(cache_version="1.0", cache=True, limits=Resources(mem="600Mi"))
 def fit(loc: str, train: pd.DataFrame, val: pd.DataFrame) -> JoblibSerializedFile:
+    return fit_model(loc, train, val)
+
+
+# %%
+# When new houses are added, there's no need to retrain on the whole history. Continue boosting from the previous
+# model on the new data instead.
+@task(cache_version="1.0", cache=True, limits=Resources(mem="600Mi"))
+def fit_incremental(
+    loc: str,
+    train: pd.DataFrame,
+    val: pd.DataFrame,
+    previous_model: JoblibSerializedFile,
+) -> JoblibSerializedFile:
+    return fit_model(loc, train, val, previous_model=previous_model)
+
+
+def fit_model(
+    loc: str,
+    train: typing.Union[pd.DataFrame, pa.Table],
+    val: typing.Union[pd.DataFrame, pa.Table],
+    previous_model: typing.Optional[typing.Union[str, os.PathLike]] = None,
+) -> str:
+    return save_model(train_model(train, val, previous_model), loc)
+
+
+# %%
+# XGBoost starts as many threads as the host has cores, but a task's container is usually limited to a few of them by
+# a cgroup CPU quota, and the oversubscribed threads spend their time throttled. Train on as many threads as the
+# quota allows instead.
+def available_cpus() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        cpus = float(len(os.sched_getaffinity(0)))
+    else:
+        cpus = float(os.cpu_count() or 1)
+    # cgroup v2 stores "<quota> <period>", or "max <period>" when there is no quota
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            cpus = min(cpus, int(quota) / int(period))
+    except (OSError, ValueError):
+        # cgroup v1 stores a quota of -1 when there is none
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+            if quota > 0 and period > 0:
+                cpus = min(cpus, quota / period)
+        except (OSError, ValueError):
+            pass
+    return max(1, int(cpus))
+
+
+def train_model(
+    train: typing.Union[pd.DataFrame, pa.Table],
+    val: typing.Union[pd.DataFrame, pa.Table],
+    previous_model: typing.Optional[typing.Union[str, os.PathLike]] = None,
+) -> XGBRegressor:
 
     # Fetch the input and output data from train dataset
-    x = train[train.columns[1:]]
-    y = train[train.columns[0]]
+    x, y = features_and_target(train)
 
     # Fetch the input and output data from validation dataset
-    eval_x = val[val.columns[1:]]
-    eval_y = val[val.columns[0]]
+    eval_x, eval_y = features_and_target(val)
+
+    # Continue boosting from the previous model, if any
+    xgb_model = None
+    if previous_model is not None:
+        xgb_model = load_model(previous_model).get_booster()
+
+    m = XGBRegressor(n_jobs=available_cpus())
+    m.fit(x, y, eval_set=[(eval_x, eval_y)], xgb_model=xgb_model)
+    if xgb_model is not None:
+        m.get_booster().set_attr(
+            lineage=",".join(model_lineage(xgb_model) + [file_digest(previous_model)])
+        )
+    return m
 
-    m = XGBRegressor()
-    m.fit(x, y, eval_set=[(eval_x, eval_y)])
 
-    working_dir = flytekit.current_context().working_directory
+# %%
+# A warm-started model records the digests of the models it was trained from (oldest first) in its ``lineage``
+# attribute, which is saved along with the model.
+def model_lineage(
+    model: typing.Union[XGBRegressor, xgboost.Booster],
+) -> typing.List[str]:
+    if isinstance(model, XGBRegressor):
+        model = model.get_booster()
+    lineage = model.attr("lineage")
+    return lineage.split(",") if lineage else []
+
+
+def save_model(
+    model: XGBRegressor, loc: str, working_dir: typing.Optional[str] = None
+) -> str:
+    if working_dir is None:
+        working_dir = flytekit.current_context().working_directory
     fname = os.path.join(working_dir, f"model-{loc}.joblib.dat")
-    joblib.dump(m, fname)
+    joblib.dump(model, fname)
     return fname
 
 
+# %%
+# Caching the Loaded Models
+# =========================
+#
+# A long-running executor may score many test sets against the same model, and loading the model can cost more
+# than the predictions themselves. Keep the last ``MODEL_CACHE_SIZE`` loaded models in memory, keyed on the digest
+# of the model file's content, and count the cache hits and misses.
+_model_cache = OrderedDict()
+_model_cache_lock = threading.Lock()
+model_cache_stats = {"hits": 0, "misses": 0}
+
+
+def file_digest(path: typing.Union[str, os.PathLike]) -> str:
+    _digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            _digest.update(block)
+    return _digest.hexdigest()
+
+
+def load_model(model_ser: typing.Union[str, os.PathLike]) -> XGBRegressor:
+    key = file_digest(model_ser)
+    with _model_cache_lock:
+        if key in _model_cache:
+            model_cache_stats["hits"] += 1
+            _model_cache.move_to_end(key)
+            return _model_cache[key]
+        model_cache_stats["misses"] += 1
+    model = joblib.load(model_ser)
+    with _model_cache_lock:
+        _model_cache[key] = model
+        while len(_model_cache) > MODEL_CACHE_SIZE:
+            _model_cache.popitem(last=False)
+    return model
+
+
+# %%
+# Drop a model from the cache, or every model if none is given.
+def invalidate_model_cache(
+    model_ser: typing.Optional[typing.Union[str, os.PathLike]] = None,
+):
+    with _model_cache_lock:
+        if model_ser is None:
+            _model_cache.clear()
+        else:
+            _model_cache.pop(file_digest(model_ser), None)
+
+
 # %%
 # Task: Generating the Predictions
 # ================================
 #
-# Unserialize the XGBoost model using joblib and generate the predictions.
-@task(cache_version="1.0", cache=True, limits=Resources(mem="600Mi"))
+# Unserialize the XGBoost model using joblib (through the model cache) and generate the predictions.
+# The predictions are returned as a float32 ``.npy`` file rather than a list of floats, which Flyte would have to
+# serialize one literal at a time. Load them with ``np.load``.
+NumpyFile = FlyteFile[typing.TypeVar("npy")]
+
+
+@task(cache_version="2.0", cache=True, limits=Resources(mem="600Mi"))
 def predict(
     test: pd.DataFrame,
     model_ser: JoblibSerializedFile,
-) -> typing.List[float]:
+) -> NumpyFile:
+    return save_predictions(predict_prices(test, model_ser))
+
+
+def predict_prices(
+    test: typing.Union[pd.DataFrame, pa.Table],
+    model_ser: typing.Union[str, os.PathLike],
+) -> np.ndarray:
 
     # Load model
-    model = joblib.load(model_ser)
+    model = load_model(model_ser)
 
     # Load test data
-    x_df = test[test.columns[1:]]
+    x, _ = features_and_target(test)
 
     # Generate predictions
-    y_pred = model.predict(x_df).tolist()
+    y_pred = model.predict(x)
 
     return y_pred
 
 
+def save_predictions(y_pred: np.ndarray, name: str = "predictions") -> str:
+    working_dir = flytekit.current_context().working_directory
+    fname = os.path.join(working_dir, f"{name}.npy")
+    np.save(fname, y_pred.astype(np.float32, copy=False))
+    return fname
+
+
+# %%
+# Task: Training the Model & Generating the Predictions in One Go
+# ===============================================================
+#
+# When the test data is available at training time, chaining ``fit`` into ``predict`` serializes the model, uploads
+# it, downloads it, and deserializes it again only to score the test data. Predict with the trained model while it
+# is still in memory instead, and still return the serialized model for later use. With ``async_save``, the model is
+# serialized on a background thread while the predictions are computed, since XGBoost releases the GIL for both.
+fit_predict_outputs = typing.NamedTuple(
+    "FitPredictOutputs", model=JoblibSerializedFile, predictions=NumpyFile
+)
+
+
+@task(cache_version="1.0", cache=True, limits=Resources(mem="600Mi"))
+def fit_predict(
+    loc: str,
+    train: pd.DataFrame,
+    val: pd.DataFrame,
+    test: pd.DataFrame,
+    async_save: bool = True,
+) -> fit_predict_outputs:
+    model_ser, y_pred = fit_predict_model(loc, train, val, test, async_save)
+    return model_ser, save_predictions(y_pred, name=f"predictions-{loc}")
+
+
+def fit_predict_model(
+    loc: str,
+    train: typing.Union[pd.DataFrame, pa.Table],
+    val: typing.Union[pd.DataFrame, pa.Table],
+    test: typing.Union[pd.DataFrame, pa.Table],
+    async_save: bool = True,
+) -> Tuple[str, np.ndarray]:
+    model = train_model(train, val)
+    x, _ = features_and_target(test)
+    if not async_save:
+        return save_model(model, loc), model.predict(x)
+    # The Flyte context isn't inherited by the background thread, so the working directory is looked up here
+    working_dir = flytekit.current_context().working_directory
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        model_ser = pool.submit(save_model, model, loc, working_dir)
+        y_pred = model.predict(x)
+        return model_ser.result(), y_pred
+
+
+# %%
+# Tasks: Training & Predicting with Split Indices
+# ===============================================
+#
+# Variants of the previous two tasks that select their rows from the generated data using the split indices.
+@task(cache_version="1.1", cache=True, limits=Resources(mem="600Mi"))
+def fit_with_split_indices(
+    loc: str, houses: pd.DataFrame, split_indices: NPZFile, seed: int, split_mode: str
+) -> JoblibSerializedFile:
+    train_idx, val_idx, _ = load_split_indices(
+        split_indices,
+        dataset_hash=hash_dataset(houses),
+        seed=seed,
+        split=SPLIT_RATIOS,
+        mode=split_mode,
+    )
+    train, val = take_splits(houses, (train_idx, val_idx))
+    return fit_model(loc, train, val)
+
+
+@task(cache_version="2.1", cache=True, limits=Resources(mem="600Mi"))
+def predict_with_split_indices(
+    houses: pd.DataFrame,
+    split_indices: NPZFile,
+    seed: int,
+    split_mode: str,
+    model_ser: JoblibSerializedFile,
+) -> NumpyFile:
+    _, _, test_idx = load_split_indices(
+        split_indices,
+        dataset_hash=hash_dataset(houses),
+        seed=seed,
+        split=SPLIT_RATIOS,
+        mode=split_mode,
+    )
+    (test,) = take_splits(houses, (test_idx,))
+    return save_predictions(predict_prices(test, model_ser))
+
+
+# %%
+# Tasks: Training & Predicting with Arrow Files
+# =============================================
+#
+# Variants of the training and prediction tasks that memory-map the Arrow files instead of loading DataFrames.
+@task(cache_version="1.0", cache=True, limits=Resources(mem="600Mi"))
+def fit_arrow(loc: str, train: ArrowFile, val: ArrowFile) -> JoblibSerializedFile:
+    return fit_model(loc, read_arrow(train), read_arrow(val))
+
+
+@task(cache_version="2.0", cache=True, limits=Resources(mem="600Mi"))
+def predict_arrow(test: ArrowFile, model_ser: JoblibSerializedFile) -> NumpyFile:
+    return save_predictions(predict_prices(read_arrow(test), model_ser))
+
+
+# %%
+# Task: Generating the Predictions in Batches
+# ===========================================
+#
+# A list of Python floats takes several GB for tens of millions of predictions, and the test data may not fit in
+# memory either. Read the test data (a directory of Parquet shards, such as the ones written by
+# ``generate_and_split_data_streaming``) one batch at a time, predict every batch with ``inplace_predict``, and
+# write the predictions straight into a float32 ``.npy`` file. The peak memory depends only on ``batch_size``.
+def parquet_files(path: typing.Union[str, os.PathLike]) -> typing.List[str]:
+    path = os.fspath(path)
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(path)
+        for name in names
+        if name.endswith(".parquet")
+    )
+
+
+def predict_in_batches(
+    test: typing.Union[str, os.PathLike],
+    model_ser: typing.Union[str, os.PathLike],
+    output_path: str,
+    batch_size: int = PREDICT_BATCH_SIZE,
+) -> str:
+    booster = load_model(model_ser).get_booster()
+    files = [pq.ParquetFile(f) for f in parquet_files(test)]
+    num_rows = sum(f.metadata.num_rows for f in files)
+
+    # The predictions are written through a memory map, so they never have to fit in memory at once
+    y_pred = np.lib.format.open_memmap(
+        output_path, mode="w+", dtype=np.float32, shape=(num_rows,)
+    )
+    start = 0
+    for f in files:
+        for batch in f.iter_batches(batch_size=batch_size):
+            x, _ = features_and_target(batch)
+            y_pred[start : start + batch.num_rows] = booster.inplace_predict(x)
+            start += batch.num_rows
+    y_pred.flush()
+    del y_pred
+    return output_path
+
+
+@task(cache_version="1.0", cache=True, limits=Resources(mem="600Mi"))
+def predict_batched(
+    test: FlyteDirectory,
+    model_ser: JoblibSerializedFile,
+    batch_size: int = PREDICT_BATCH_SIZE,
+) -> NumpyFile:
+    working_dir = flytekit.current_context().working_directory
+    return predict_in_batches(
+        test.download(),
+        model_ser,
+        os.path.join(working_dir, "predictions.npy"),
+        batch_size=batch_size,
+    )
+
+
 # %%
 # Defining the Workflow
 # =====================
@@ -226,7 +891,7 @@ def predict(
 @workflow
 def house_price_predictor_trainer(
     seed: int = 7, number_of_houses: int = NUM_HOUSES_PER_LOCATION
-) -> typing.List[float]:
+) -> NumpyFile:
 
     # Generate and split the data
     split_data_vals = generate_and_split_data(
@@ -244,11 +909,45 @@ def house_price_predictor_trainer(
     return predictions
 
 
+# %%
+# The same workflow, built on the cached split indices. ``split_mode`` is one of ``SPLIT_MODES``.
+@workflow
+def house_price_predictor_trainer_with_split_indices(
+    seed: int = 7,
+    number_of_houses: int = NUM_HOUSES_PER_LOCATION,
+    split_mode: str = "random",
+) -> NumpyFile:
+
+    # Generate the data and compute the split indices
+    houses = generate_houses(number_of_houses=number_of_houses, seed=seed)
+    split_indices = build_split_indices(houses=houses, seed=seed, split_mode=split_mode)
+
+    # Fit the XGBoost model
+    model = fit_with_split_indices(
+        loc="NewYork_NY",
+        houses=houses,
+        split_indices=split_indices,
+        seed=seed,
+        split_mode=split_mode,
+    )
+
+    # Generate predictions
+    predictions = predict_with_split_indices(
+        houses=houses,
+        split_indices=split_indices,
+        seed=seed,
+        split_mode=split_mode,
+        model_ser=model,
+    )
+
+    return predictions
+
+
 # %%
 # Trigger the workflow locally by calling the workflow function.
 if __name__ == "__main__":
-    print(house_price_predictor_trainer())
+    print(np.load(house_price_predictor_trainer()))
 
 
 # %%
-# The output will be a list of house price predictions.
+# The output will be an array of house price predictions.
@@ -10,22 +10,61 @@ In this example, you'll use the house price prediction model for one region to e
 # =======================
 #
 # First, import all the required libraries.
+import logging
+import multiprocessing
+import os
+import traceback
 import typing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
 
-import pandas as pd
-from flytekit import Resources, dynamic, workflow
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+from dataclasses_json import dataclass_json
+import flytekit
+from flytekit import Resources, dynamic, map_task, task, workflow
+from flytekit.core.context_manager import FlyteContextManager
+from flytekit.types.directory import FlyteDirectory
+from flytekit.types.file import JoblibSerializedFile
 
 try:
     from .house_price_predictor import (
-        generate_and_split_data,
-        fit,
-        predict,
+        COLUMNS,
+        SPLIT_NAMES,
+        SPLIT_RATIOS,
+        ArrowFile,
+        HouseDistribution,
+        NumpyFile,
+        generate_and_split_data_arrow,
+        fit_arrow,
+        fit_model,
+        fit_predict_model,
+        fit_predict_outputs,
+        gen_houses,
+        predict_arrow,
+        predict_prices,
+        save_predictions,
+        split_data,
     )
 except ImportError:
     from house_price_predictor import (
-        generate_and_split_data,
-        fit,
-        predict,
+        COLUMNS,
+        SPLIT_NAMES,
+        SPLIT_RATIOS,
+        ArrowFile,
+        HouseDistribution,
+        NumpyFile,
+        generate_and_split_data_arrow,
+        fit_arrow,
+        fit_model,
+        fit_predict_model,
+        fit_predict_outputs,
+        gen_houses,
+        predict_arrow,
+        predict_prices,
+        save_predictions,
+        split_data,
     )
 
 # %%
@@ -33,16 +72,9 @@ except ImportError:
 # ===========================
 #
 # Initialize the variables to be used while building the model.
+logger = logging.getLogger(__name__)
+
 NUM_HOUSES_PER_LOCATION = 1000
-COLUMNS = [
-    "PRICE",
-    "YEAR_BUILT",
-    "SQUARE_FEET",
-    "NUM_BEDROOMS",
-    "NUM_BATHROOMS",
-    "LOT_ACRES",
-    "GARAGE_SPACES",
-]
 LOCATIONS = [
     "NewYork_NY",
     "LosAngeles_CA",
@@ -50,43 +82,137 @@ LOCATIONS = [
     "Houston_TX",
     "Dallas_TX",
 ]
+REGION_DISTRIBUTIONS = {
+    "NewYork_NY": HouseDistribution(
+        square_feet_mean=1800,
+        square_feet_std=600,
+        lot_acres_mean=0.2,
+        lot_acres_std=0.05,
+        year_built_mean=1960,
+        year_built_std=25,
+        price_per_square_foot=450,
+    ),
+    "LosAngeles_CA": HouseDistribution(
+        square_feet_mean=2200,
+        square_feet_std=700,
+        lot_acres_mean=0.3,
+        lot_acres_std=0.1,
+        year_built_mean=1975,
+        year_built_std=20,
+        price_per_square_foot=400,
+    ),
+    "Chicago_IL": HouseDistribution(year_built_mean=1970, year_built_std=25),
+}
+MAP_CONCURRENCY = 8
+MIN_SUCCESS_RATIO = 0.9
+REGION_RETRIES = 2
+
+
+# %%
+# Every region gets its own seed, derived from the workflow's seed. The derived seeds are independent of each other,
+# so every region has different data, and the same workflow seed always reproduces the same regions.
+def region_seeds(seed: int, num_regions: int) -> typing.List[int]:
+    return [
+        int(child.generate_state(1)[0])
+        for child in np.random.SeedSequence(seed).spawn(num_regions)
+    ]
+
 
 # %%
 # Task: Generating & Splitting the Data for Multiple Regions
 # ==========================================================
 #
-# Call the previously defined helper functions to generate and split the data. Finally, return the DataFrame objects.
-dataset = typing.NamedTuple(
-    "GenerateSplitDataOutputs",
-    train_data=typing.List[pd.DataFrame],
-    val_data=typing.List[pd.DataFrame],
-    test_data=typing.List[pd.DataFrame],
-)
+# Generate every region in a single task, each from its own seed and with its own ``REGION_DISTRIBUTIONS`` (the
+# default distribution otherwise), and split it. Instead of returning one DataFrame per region and split, write all
+# of them to a single Hive-partitioned Parquet dataset, with one ``region=<location>/split=<split>`` directory per
+# region and split. NumPy's random generators and Parquet writes release the GIL, so the regions are generated on a
+# thread pool that uses all the cores.
+def write_region_partition(
+    output_dir: str, loc: str, seed: int, number_of_houses: int
+) -> str:
+    houses = gen_houses(
+        number_of_houses, seed=seed, distribution=REGION_DISTRIBUTIONS.get(loc)
+    )
+    region_dir = os.path.join(output_dir, f"region={loc}")
+    for name, split in zip(SPLIT_NAMES, split_data(houses, seed, split=SPLIT_RATIOS)):
+        split_dir = os.path.join(region_dir, f"split={name}")
+        os.makedirs(split_dir, exist_ok=True)
+        split.to_parquet(os.path.join(split_dir, "part-00000.parquet"), index=False)
+    return region_dir
 
 
-@dynamic(cache=True, cache_version="0.2", limits=Resources(mem="600Mi"))
-def generate_and_split_data_multiloc(
+def write_multiregion_dataset(
+    output_dir: str,
     locations: typing.List[str],
     number_of_houses_per_location: int,
     seed: int,
-) -> dataset:
-    train_sets = []
-    val_sets = []
-    test_sets = []
-    for _ in locations:
-        _train, _val, _test = generate_and_split_data(
-            number_of_houses=number_of_houses_per_location, seed=seed
-        )
-        train_sets.append(
-            _train,
+    max_workers: typing.Optional[int] = None,
+) -> str:
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+        list(
+            pool.map(
+                write_region_partition,
+                [output_dir] * len(locations),
+                locations,
+                region_seeds(seed, len(locations)),
+                [number_of_houses_per_location] * len(locations),
+            )
         )
-        val_sets.append(
-            _val,
+    return output_dir
+
+
+@task(cache=True, cache_version="1.0", limits=Resources(mem="600Mi"))
+def generate_and_split_data_multiloc(
+    locations: typing.List[str],
+    number_of_houses_per_location: int,
+    seed: int,
+) -> FlyteDirectory:
+    working_dir = flytekit.current_context().working_directory
+    return FlyteDirectory(
+        path=write_multiregion_dataset(
+            os.path.join(working_dir, "houses"),
+            locations,
+            number_of_houses_per_location,
+            seed,
         )
-        test_sets.append(
-            _test,
+    )
+
+
+# %%
+# Every consumer reads only the partition of its own region and split. Rather than downloading the whole dataset, the
+# task downloads the ``region=<location>/split=<split>`` directory alone, through flytekit's data persistence layer,
+# so the storage configured for flytekit (such as the sandbox's MinIO) is used. A task reads one region's data
+# however many regions the dataset holds.
+def read_partition(houses: FlyteDirectory, loc: str, split: str) -> pa.Table:
+    partition = f"region={loc}/split={split}"
+    if houses.remote_source:
+        file_access = FlyteContextManager.current_context().file_access
+        local_dir = file_access.get_random_local_directory()
+        file_access.get_data(
+            f"{houses.remote_source.rstrip('/')}/{partition}",
+            local_dir,
+            is_multipart=True,
         )
-    return train_sets, val_sets, test_sets
+    else:
+        local_dir = os.path.join(houses.path, partition)
+    return ds.dataset(local_dir, format="parquet").to_table(columns=COLUMNS)
+
+
+@task(cache_version="1.0", cache=True, limits=Resources(mem="600Mi"))
+def fit_partition(houses: FlyteDirectory, loc: str) -> JoblibSerializedFile:
+    return fit_model(
+        loc, read_partition(houses, loc, "train"), read_partition(houses, loc, "val")
+    )
+
+
+@task(cache_version="1.0", cache=True, limits=Resources(mem="600Mi"))
+def predict_partition(
+    houses: FlyteDirectory, loc: str, model_ser: JoblibSerializedFile
+) -> NumpyFile:
+    return save_predictions(
+        predict_prices(read_partition(houses, loc, "test"), model_ser),
+        name=f"predictions-{loc}",
+    )
 
 
 # %%
@@ -96,21 +222,240 @@ def generate_and_split_data_multiloc(
 # Fit the model to the data and generate predictions (two functionalities in a single task to make it more powerful!)
 #
 # Note: You can also use two separate methods to fit the model and generate predictions but this basically means parallelizing an entire set of tasks.
-@dynamic(cache=True, cache_version="0.2", limits=Resources(mem="600Mi"))
+@dynamic(cache=True, cache_version="1.0", limits=Resources(mem="600Mi"))
 def parallel_fit_predict(
-    multi_train: typing.List[pd.DataFrame],
-    multi_val: typing.List[pd.DataFrame],
-    multi_test: typing.List[pd.DataFrame],
-) -> typing.List[typing.List[float]]:
+    houses: FlyteDirectory, locations: typing.List[str]
+) -> typing.List[NumpyFile]:
     preds = []
 
-    for loc, train, val, test in zip(LOCATIONS, multi_train, multi_val, multi_test):
-        model = fit(loc=loc, train=train, val=val)
-        preds.append(predict(test=test, model_ser=model))
+    for loc in locations:
+        model = fit_partition(houses=houses, loc=loc)
+        preds.append(predict_partition(houses=houses, loc=loc, model_ser=model))
 
     return preds
 
 
+# %%
+# The same dynamic workflow, fitting and predicting every region in a single task that predicts with the trained
+# model while it is still in memory, instead of reloading it from the serialized model file.
+@task(cache_version="1.0", cache=True, limits=Resources(mem="600Mi"))
+def fit_predict_partition(houses: FlyteDirectory, loc: str) -> fit_predict_outputs:
+    model_ser, y_pred = fit_predict_model(
+        loc,
+        read_partition(houses, loc, "train"),
+        read_partition(houses, loc, "val"),
+        read_partition(houses, loc, "test"),
+    )
+    return model_ser, save_predictions(y_pred, name=f"predictions-{loc}")
+
+
+@dynamic(cache=True, cache_version="1.0", limits=Resources(mem="600Mi"))
+def parallel_fit_predict_fused(
+    houses: FlyteDirectory, locations: typing.List[str]
+) -> typing.List[NumpyFile]:
+    preds = []
+
+    for loc in locations:
+        preds.append(fit_predict_partition(houses=houses, loc=loc).predictions)
+
+    return preds
+
+
+# %%
+# Dynamic Workflows: Passing Arrow Files Between the Tasks
+# ========================================================
+#
+# Every region pays the DataFrame conversion twice (in ``fit`` and in ``predict``), so the multi-region pipeline
+# benefits the most from memory-mapped Arrow files.
+arrow_dataset = typing.NamedTuple(
+    "GenerateSplitDataArrowOutputs",
+    train_data=typing.List[ArrowFile],
+    val_data=typing.List[ArrowFile],
+    test_data=typing.List[ArrowFile],
+)
+
+
+@dynamic(cache=True, cache_version="0.3", limits=Resources(mem="600Mi"))
+def generate_and_split_data_multiloc_arrow(
+    locations: typing.List[str],
+    number_of_houses_per_location: int,
+    seed: int,
+) -> arrow_dataset:
+    train_sets = []
+    val_sets = []
+    test_sets = []
+    for loc, _seed in zip(locations, region_seeds(seed, len(locations))):
+        _train, _val, _test = generate_and_split_data_arrow(
+            number_of_houses=number_of_houses_per_location,
+            seed=_seed,
+            distribution=REGION_DISTRIBUTIONS.get(loc, HouseDistribution()),
+        )
+        train_sets.append(_train)
+        val_sets.append(_val)
+        test_sets.append(_test)
+    return train_sets, val_sets, test_sets
+
+
+@dynamic(cache=True, cache_version="0.3", limits=Resources(mem="600Mi"))
+def parallel_fit_predict_arrow(
+    locations: typing.List[str],
+    multi_train: typing.List[ArrowFile],
+    multi_val: typing.List[ArrowFile],
+    multi_test: typing.List[ArrowFile],
+) -> typing.List[NumpyFile]:
+    preds = []
+
+    for loc, train, val, test in zip(locations, multi_train, multi_val, multi_test):
+        model = fit_arrow(loc=loc, train=train, val=val)
+        preds.append(predict_arrow(test=test, model_ser=model))
+
+    return preds
+
+
+# %%
+# Map Task: Training the XGBoost Model & Generating the Predictions per Region
+# ============================================================================
+#
+# The dynamic workflows above compile one ``fit`` and one ``predict`` node per region, so the workflow spec grows with
+# the number of regions and every node pays for its own container start. A map task runs the same task over a list of
+# inputs instead: at most ``MAP_CONCURRENCY`` regions run at a time, every region is retried up to ``REGION_RETRIES``
+# times, and the map task succeeds as long as ``MIN_SUCCESS_RATIO`` of the regions do.
+#
+# A mapped task takes a single input, so everything a region needs is bundled in a dataclass. Every region generates,
+# splits, trains on, and predicts its own data.
+@dataclass_json
+@dataclass
+class RegionInput(object):
+    loc: str
+    seed: int
+    number_of_houses: int
+
+
+def region_predictions(region: RegionInput) -> str:
+    train, val, test = split_data(
+        gen_houses(
+            region.number_of_houses,
+            seed=region.seed,
+            distribution=REGION_DISTRIBUTIONS.get(region.loc),
+        ),
+        region.seed,
+        split=SPLIT_RATIOS,
+    )
+    _, y_pred = fit_predict_model(region.loc, train, val, test)
+    return save_predictions(y_pred, name=f"predictions-{region.loc}")
+
+
+@task(
+    cache=True,
+    cache_version="0.1",
+    retries=REGION_RETRIES,
+    limits=Resources(mem="600Mi"),
+)
+def fit_predict_region(region: RegionInput) -> NumpyFile:
+    return region_predictions(region)
+
+
+@task(cache=True, cache_version="0.2")
+def make_region_inputs(
+    locations: typing.List[str], number_of_houses_per_location: int, seed: int
+) -> typing.List[RegionInput]:
+    return [
+        RegionInput(loc=loc, seed=_seed, number_of_houses=number_of_houses_per_location)
+        for loc, _seed in zip(locations, region_seeds(seed, len(locations)))
+    ]
+
+
+map_fit_predict_region = map_task(
+    fit_predict_region,
+    concurrency=MAP_CONCURRENCY,
+    min_success_ratio=MIN_SUCCESS_RATIO,
+)
+# Depending on the flytekit version, a map task that tolerates failures returns optional items
+MappedPredictions = map_fit_predict_region.python_interface.outputs["o0"]
+
+
+# %%
+# Running the Mapped Regions on a Local Process Pool
+# ==================================================
+#
+# When the workflow runs locally, the map task runs its items one after another. Define a function with the same
+# semantics (concurrency limit, retries, and minimum success ratio) that runs the items on a process pool, and a task
+# that uses it, so all the cores of a single machine are used. Every item gets a ``MapResult`` that records whether it
+# succeeded, how many attempts it took, and the traceback of its last failure. The worker processes are spawned rather
+# than forked, since XGBoost's OpenMP thread pool is not safe to fork. Regions that fail even after their retries get
+# an empty predictions file.
+class MapResult(typing.NamedTuple):
+    value: typing.Any = None
+    attempts: int = 0
+    error: typing.Optional[str] = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+def _run_with_retries(fn: typing.Callable, item: typing.Any, retries: int) -> MapResult:
+    for attempt in range(1, retries + 2):
+        try:
+            return MapResult(value=fn(item), attempts=attempt)
+        except Exception:
+            # Exceptions may not be picklable, so the traceback is sent back to the parent as text
+            error = traceback.format_exc()
+    return MapResult(attempts=retries + 1, error=error)
+
+
+def map_locally(
+    fn: typing.Callable,
+    items: typing.List[typing.Any],
+    concurrency: int = MAP_CONCURRENCY,
+    min_success_ratio: float = MIN_SUCCESS_RATIO,
+    retries: int = REGION_RETRIES,
+) -> typing.List[MapResult]:
+    with ProcessPoolExecutor(
+        max_workers=concurrency or None, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        results = list(
+            pool.map(
+                _run_with_retries,
+                [fn] * len(items),
+                items,
+                [retries] * len(items),
+            )
+        )
+    for item, result in zip(items, results):
+        if not result.succeeded:
+            logger.error(
+                "Giving up on %s after %d attempts:\n%s",
+                item,
+                result.attempts,
+                result.error,
+            )
+    num_succeeded = sum(result.succeeded for result in results)
+    if items and num_succeeded / len(items) < min_success_ratio:
+        raise RuntimeError(
+            f"Only {num_succeeded} of {len(items)} items succeeded, "
+            f"below the minimum success ratio of {min_success_ratio}"
+        )
+    return results
+
+
+@task(limits=Resources(mem="600Mi"))
+def fit_predict_regions_locally(
+    regions: typing.List[RegionInput], concurrency: int = MAP_CONCURRENCY
+) -> typing.List[NumpyFile]:
+    results = map_locally(region_predictions, regions, concurrency=concurrency)
+    return [
+        (
+            result.value
+            if result.succeeded
+            else save_predictions(
+                np.empty(0, dtype=np.float32), name=f"predictions-{region.loc}"
+            )
+        )
+        for region, result in zip(regions, results)
+    ]
+
+
 # %%
 # Defining the Workflow
 # ======================
@@ -122,10 +467,10 @@ def parallel_fit_predict(
 @workflow
 def multi_region_house_price_prediction_model_trainer(
     seed: int = 7, number_of_houses: int = NUM_HOUSES_PER_LOCATION
-) -> typing.List[typing.List[float]]:
+) -> typing.List[NumpyFile]:
 
     # Generate and split the data
-    split_data_vals = generate_and_split_data_multiloc(
+    houses = generate_and_split_data_multiloc(
         locations=LOCATIONS,
         number_of_houses_per_location=number_of_houses,
         seed=seed,
@@ -133,7 +478,42 @@ def multi_region_house_price_prediction_model_trainer(
 
     # Parallelly fit the XGBoost model for multiple regions
     # Generate predictions for multiple regions
-    predictions = parallel_fit_predict(
+    predictions = parallel_fit_predict(houses=houses, locations=LOCATIONS)
+
+    return predictions
+
+
+# %%
+# The same workflow, fitting and predicting every region in a single task.
+@workflow
+def multi_region_house_price_prediction_model_trainer_fused(
+    seed: int = 7, number_of_houses: int = NUM_HOUSES_PER_LOCATION
+) -> typing.List[NumpyFile]:
+    houses = generate_and_split_data_multiloc(
+        locations=LOCATIONS,
+        number_of_houses_per_location=number_of_houses,
+        seed=seed,
+    )
+    return parallel_fit_predict_fused(houses=houses, locations=LOCATIONS)
+
+
+# %%
+# The same workflow, passing the data between the tasks as Arrow files.
+@workflow
+def multi_region_house_price_prediction_model_trainer_arrow(
+    seed: int = 7, number_of_houses: int = NUM_HOUSES_PER_LOCATION
+) -> typing.List[NumpyFile]:
+
+    # Generate and split the data
+    split_data_vals = generate_and_split_data_multiloc_arrow(
+        locations=LOCATIONS,
+        number_of_houses_per_location=number_of_houses,
+        seed=seed,
+    )
+
+    # Parallelly fit the XGBoost model and generate predictions for multiple regions
+    predictions = parallel_fit_predict_arrow(
+        locations=LOCATIONS,
         multi_train=split_data_vals.train_data,
         multi_val=split_data_vals.val_data,
         multi_test=split_data_vals.test_data,
@@ -142,11 +522,44 @@ def multi_region_house_price_prediction_model_trainer(
     return predictions
 
 
+# %%
+# The same workflow, fanning out the regions with the map task. It scales to thousands of regions, since the
+# workflow spec has a single map node however many regions there are.
+@workflow
+def multi_region_house_price_prediction_model_trainer_map(
+    seed: int = 7, number_of_houses: int = NUM_HOUSES_PER_LOCATION
+) -> MappedPredictions:
+    regions = make_region_inputs(
+        locations=LOCATIONS,
+        number_of_houses_per_location=number_of_houses,
+        seed=seed,
+    )
+    return map_fit_predict_region(region=regions)
+
+
+# %%
+# The same workflow, running the regions on a local process pool instead of the map task. Use it to train every
+# region on a single machine.
+@workflow
+def multi_region_house_price_prediction_model_trainer_local(
+    seed: int = 7,
+    number_of_houses: int = NUM_HOUSES_PER_LOCATION,
+    concurrency: int = MAP_CONCURRENCY,
+) -> typing.List[NumpyFile]:
+    regions = make_region_inputs(
+        locations=LOCATIONS,
+        number_of_houses_per_location=number_of_houses,
+        seed=seed,
+    )
+    return fit_predict_regions_locally(regions=regions, concurrency=concurrency)
+
+
 # %%
 # Trigger the workflow locally by calling the workflow function.
 if __name__ == "__main__":
-    print(multi_region_house_price_prediction_model_trainer())
+    for predictions in multi_region_house_price_prediction_model_trainer():
+        print(np.load(predictions))
 
 
 # %%
-# The output will be a list of lists (one list per region) of house price predictions.
+# The output will be a list of arrays (one array per region) of house price predictions.
@@ -0,0 +1,315 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from flytekit.core.context_manager import ExecutionParameters, FlyteContextManager
+from flytekit.types.directory import FlyteDirectory
+
+try:
+    from .benchmarks import split_data_legacy
+    from .house_price_predictor import (
+        SPLIT_NAMES,
+        SPLIT_RATIOS,
+        build_split_indices,
+        fit_model,
+        fit_predict_model,
+        gen_houses,
+        get_split_indices,
+        hash_dataset,
+        invalidate_model_cache,
+        iter_houses,
+        load_model,
+        load_split_indices,
+        model_cache_stats,
+        predict_in_batches,
+        predict_prices,
+        save_split_indices,
+        split_data,
+        split_indices_name,
+        write_split_shards,
+    )
+    from .multiregion_house_price_predictor import (
+        REGION_DISTRIBUTIONS,
+        _run_with_retries,
+        map_locally,
+        read_partition,
+        region_seeds,
+        write_multiregion_dataset,
+    )
+except ImportError:
+    from benchmarks import split_data_legacy
+    from house_price_predictor import (
+        SPLIT_NAMES,
+        SPLIT_RATIOS,
+        build_split_indices,
+        fit_model,
+        fit_predict_model,
+        gen_houses,
+        get_split_indices,
+        hash_dataset,
+        invalidate_model_cache,
+        iter_houses,
+        load_model,
+        load_split_indices,
+        model_cache_stats,
+        predict_in_batches,
+        predict_prices,
+        save_split_indices,
+        split_data,
+        split_indices_name,
+        write_split_shards,
+    )
+    from multiregion_house_price_predictor import (
+        REGION_DISTRIBUTIONS,
+        _run_with_retries,
+        map_locally,
+        read_partition,
+        region_seeds,
+        write_multiregion_dataset,
+    )
+
+
+def sorted_rows(df: pd.DataFrame) -> pd.DataFrame:
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+
+def assert_partition(indices, num_samples: int):
+    np.testing.assert_array_equal(
+        np.sort(np.concatenate(indices)), np.arange(num_samples)
+    )
+
+
+def test_gen_houses_seeded():
+    houses = gen_houses(1000, seed=7)
+    pd.testing.assert_frame_equal(houses, gen_houses(1000, seed=7))
+    assert not houses.equals(gen_houses(1000, seed=8))
+
+    # A single chunk is the same as generating all the houses at once
+    pd.testing.assert_frame_equal(
+        next(iter_houses(1000, seed=7, chunk_size=1000)), houses
+    )
+    chunks = list(iter_houses(1000, seed=7, chunk_size=300))
+    assert [chunk.shape[0] for chunk in chunks] == [300, 300, 300, 100]
+    pd.testing.assert_frame_equal(
+        pd.concat(chunks, ignore_index=True),
+        pd.concat(iter_houses(1000, seed=7, chunk_size=300), ignore_index=True),
+    )
+
+
+def test_split_shards(tmp_path):
+    split_dirs = write_split_shards(
+        1000, 7, split=SPLIT_RATIOS, output_dir=str(tmp_path), chunk_size=300
+    )
+    assert [os.path.basename(split_dir) for split_dir in split_dirs] == SPLIT_NAMES
+
+    shards = [pq.ParquetFile(os.path.join(d, "part-00000.parquet")) for d in split_dirs]
+    # Every chunk is appended to every shard as a row group
+    assert [shard.metadata.num_row_groups for shard in shards] == [4, 4, 4]
+
+    splits = [shard.read().to_pandas() for shard in shards]
+    assert sum(split.shape[0] for split in splits) == 1000
+    houses = pd.concat(iter_houses(1000, seed=7, chunk_size=300), ignore_index=True)
+    pd.testing.assert_frame_equal(
+        sorted_rows(pd.concat(splits, ignore_index=True)), sorted_rows(houses)
+    )
+
+
+@pytest.mark.parametrize("seed", [0, 7, 42])
+def test_split_matches_legacy(seed):
+    houses = gen_houses(1000, seed=seed)
+    for actual, expected in zip(
+        split_data(houses, seed, SPLIT_RATIOS),
+        split_data_legacy(houses, seed, SPLIT_RATIOS),
+    ):
+        # The legacy splitter upcasts every column to float64
+        pd.testing.assert_frame_equal(actual.astype(np.float64), expected)
+
+
+def test_split_modes():
+    houses = gen_houses(1000, seed=7)
+
+    stratified = get_split_indices(houses, 7, SPLIT_RATIOS, mode="stratified")
+    assert_partition(stratified, 1000)
+    assert [len(indices) for indices in stratified] == [600, 300, 100]
+    # Every price decile is cut with the split ratios (up to rounding, since ties make the deciles uneven)
+    deciles = pd.qcut(houses["PRICE"], 10, labels=False).to_numpy()
+    for indices, ratio in zip(stratified, SPLIT_RATIOS):
+        np.testing.assert_allclose(
+            np.bincount(deciles[indices], minlength=10),
+            np.bincount(deciles) * ratio,
+            atol=1,
+        )
+
+    time = get_split_indices(houses, 7, SPLIT_RATIOS, mode="time")
+    assert_partition(time, 1000)
+    years = houses["YEAR_BUILT"].to_numpy()
+    train, val, test = (years[indices] for indices in time)
+    assert train.max() <= val.min() and val.max() <= test.min()
+
+    with pytest.raises(ValueError):
+        get_split_indices(houses, 7, SPLIT_RATIOS, mode="alphabetical")
+
+
+def test_split_indices_round_trip(tmp_path):
+    houses = gen_houses(1000, seed=7)
+    dataset_hash = hash_dataset(houses)
+    indices = get_split_indices(houses, 7, SPLIT_RATIOS, mode="stratified")
+    path = str(tmp_path / "split.npz")
+    save_split_indices(
+        path, indices, dataset_hash, seed=7, split=SPLIT_RATIOS, mode="stratified"
+    )
+
+    loaded = load_split_indices(
+        path, dataset_hash=dataset_hash, seed=7, split=SPLIT_RATIOS, mode="stratified"
+    )
+    for actual, expected in zip(loaded, indices):
+        assert actual.dtype == np.int32
+        np.testing.assert_array_equal(actual, expected)
+
+    for mismatch in [
+        {"dataset_hash": hash_dataset(gen_houses(1000, seed=8))},
+        {"seed": 8},
+        {"split": [0.8, 0.1, 0.1]},
+        {"mode": "random"},
+    ]:
+        with pytest.raises(ValueError):
+            load_split_indices(path, **mismatch)
+
+
+def test_split_indices_name():
+    houses = gen_houses(1000, seed=7)
+    name = os.path.basename(
+        build_split_indices(houses=houses, seed=7, split_mode="time")
+    )
+    assert name == split_indices_name(hash_dataset(houses), 7, SPLIT_RATIOS, "time")
+    assert name.endswith("-7-0.6-0.3-0.1.npz")
+    # Indices computed with other ratios get another file
+    assert name != split_indices_name(hash_dataset(houses), 7, [0.8, 0.1, 0.1], "time")
+
+
+@pytest.fixture(scope="module")
+def model_ser():
+    train, val, _ = split_data(gen_houses(1000, seed=7), 7, SPLIT_RATIOS)
+    return fit_model("test", train, val)
+
+
+def test_model_cache(model_ser, tmp_path):
+    invalidate_model_cache()
+    hits, misses = model_cache_stats["hits"], model_cache_stats["misses"]
+    model = load_model(model_ser)
+    assert load_model(model_ser) is model
+    assert model_cache_stats["hits"] == hits + 1
+    assert model_cache_stats["misses"] == misses + 1
+
+    # Models are cached by content, so a copy of the file is a hit too
+    copy = tmp_path / "model.joblib.dat"
+    copy.write_bytes(open(model_ser, "rb").read())
+    assert load_model(copy) is model
+
+    invalidate_model_cache(model_ser)
+    assert load_model(model_ser) is not model
+    assert model_cache_stats["misses"] == misses + 2
+
+
+@pytest.mark.parametrize("async_save", [False, True])
+def test_fit_predict_model_working_dir(tmp_path, async_save):
+    train, val, test = split_data(gen_houses(1000, seed=7), 7, SPLIT_RATIOS)
+    ctx = FlyteContextManager.current_context()
+    builder = ExecutionParameters.new_builder(ctx.user_space_params)
+    builder.working_dir = str(tmp_path)
+    with FlyteContextManager.with_context(
+        ctx.with_execution_state(
+            ctx.execution_state.with_params(user_space_params=builder.build())
+        )
+    ):
+        # The model is saved in the task's working directory, even from the background thread
+        model_ser, _ = fit_predict_model("test", train, val, test, async_save)
+    assert os.path.dirname(model_ser) == str(tmp_path)
+
+
+@pytest.mark.parametrize("batch_size", [37, 100, 1000])
+def test_predict_in_batches(model_ser, tmp_path, batch_size):
+    # Shards with several row groups, which the batches don't line up with
+    split_dirs = write_split_shards(
+        1000, 7, split=SPLIT_RATIOS, output_dir=str(tmp_path), chunk_size=300
+    )
+    test = pd.read_parquet(split_dirs[2])
+    y_pred = np.load(
+        predict_in_batches(
+            split_dirs[2],
+            model_ser,
+            str(tmp_path / "predictions.npy"),
+            batch_size=batch_size,
+        )
+    )
+    assert y_pred.dtype == np.float32
+    np.testing.assert_array_equal(y_pred, predict_prices(test, model_ser))
+
+
+def test_read_partition(tmp_path):
+    locations = ["NewYork_NY", "Springfield_IL"]
+    houses = FlyteDirectory(
+        path=write_multiregion_dataset(str(tmp_path), locations, 500, seed=7)
+    )
+    # The same dataset as a downstream task gets it, after it was uploaded to the blob store. The store is a local
+    # directory here, which the type engine never treats as remote, so the directory is set up the way it does it
+    # for a remote input
+    remote = f"file://{tmp_path / 'remote'}"
+    ctx = FlyteContextManager.current_context()
+    ctx.file_access.put_data(houses.path, remote, is_multipart=True)
+    uploaded = FlyteDirectory(path=ctx.file_access.get_random_local_directory())
+    uploaded._remote_source = remote
+    for loc, seed in zip(locations, region_seeds(7, len(locations))):
+        expected = split_data(
+            gen_houses(500, seed=seed, distribution=REGION_DISTRIBUTIONS.get(loc)),
+            seed,
+            split=SPLIT_RATIOS,
+        )
+        for name, split in zip(SPLIT_NAMES, expected):
+            for directory in [houses, uploaded]:
+                pd.testing.assert_frame_equal(
+                    read_partition(directory, loc, name).to_pandas(), split
+                )
+
+
+def flaky(item):
+    # Fails the first `failures` attempts, counting the attempts in a file since they may run in other processes
+    path, failures = item
+    with open(path, "a") as f:
+        f.write("x")
+    attempts = os.path.getsize(path)
+    if attempts <= failures:
+        raise RuntimeError(f"attempt {attempts} failed")
+    return attempts
+
+
+def test_run_with_retries(tmp_path):
+    result = _run_with_retries(flaky, (str(tmp_path / "a"), 2), retries=3)
+    assert result.succeeded
+    assert result.value == result.attempts == 3
+
+    result = _run_with_retries(flaky, (str(tmp_path / "b"), 5), retries=2)
+    assert not result.succeeded
+    assert result.value is None
+    assert result.attempts == 3
+    assert os.path.getsize(tmp_path / "b") == 3
+    assert "RuntimeError: attempt 3 failed" in result.error
+
+
+def test_map_locally(tmp_path, caplog):
+    items = [
+        (str(tmp_path / name), failures) for name, failures in zip("abc", [0, 1, 9])
+    ]
+    results = map_locally(flaky, items, concurrency=2, min_success_ratio=0.6, retries=1)
+    assert [result.succeeded for result in results] == [True, True, False]
+    assert [result.attempts for result in results] == [1, 2, 2]
+    assert "Giving up on" in caplog.text and "attempt 2 failed" in caplog.text
+
+    # The same items against a higher ratio
+    items = [
+        (str(tmp_path / name), failures) for name, failures in zip("def", [0, 1, 9])
+    ]
+    with pytest.raises(RuntimeError, match="Only 2 of 3 items succeeded"):
+        map_locally(flaky, items, concurrency=2, min_success_ratio=0.7, retries=1)
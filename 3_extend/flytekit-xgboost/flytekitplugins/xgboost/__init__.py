@@ -1,3 +1,7 @@
 # TODO Change this to import .task
-from .task_sln import (HyperParameters, ModelParameters, XGBoostParameters,
-                   XGBoostTrainerTask)
+from .task_sln import (HyperParameters, ModelParameters, NumpyFile,
+                       XGBoostModelFile, XGBoostParameters, XGBoostTrainerTask,
+                       load_booster, model_lineage)
+from .cache import DMATRIX_CACHE, MODEL_CACHE, DMatrixCache, ModelCache
+from .threads import available_cpus
+from .search import Trial, XGBoostSearchTask
@@ -0,0 +1,226 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Union
+
+import joblib
+import xgboost
+
+
+def file_digest(path: Union[str, os.PathLike], block_size: int = 1 << 20) -> str:
+    """
+    Returns the sha256 digest of the content of a file.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ModelCache(object):
+    """
+    A process-level LRU cache of loaded models, keyed on the digest of the serialized model file.
+
+    The same model uploaded to different locations is loaded only once, and a model file that changes in place is
+    loaded again.
+
+    Args:
+        max_size: Maximum number of models kept in memory.
+        loader: Function that loads a model from a file.
+    """
+
+    def __init__(self, max_size: int = 8, loader: Callable[[str], Any] = joblib.load):
+        if max_size < 1:
+            raise ValueError(f"max_size must be at least 1, got {max_size}")
+        self._max_size = max_size
+        self._loader = loader
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+    def get(
+        self,
+        path: Union[str, os.PathLike],
+        loader: Optional[Callable[[str], Any]] = None,
+    ) -> Any:
+        """
+        Returns the model stored in the file, loading it only if it isn't cached yet.
+
+        Args:
+            path: Path of the serialized model.
+            loader: Function that loads the model, overriding the cache's loader.
+        """
+        key = file_digest(path)
+        with self._lock:
+            if key in self._models:
+                self.hits += 1
+                self._models.move_to_end(key)
+                return self._models[key]
+            self.misses += 1
+        model = (loader or self._loader)(os.fspath(path))
+        with self._lock:
+            self._models[key] = model
+            self._models.move_to_end(key)
+            while len(self._models) > self._max_size:
+                self._models.popitem(last=False)
+        return model
+
+    def invalidate(self, path: Optional[Union[str, os.PathLike]] = None):
+        """
+        Drops the model stored in the file from the cache, or every model if no file is given.
+        """
+        with self._lock:
+            if path is None:
+                self._models.clear()
+            else:
+                self._models.pop(file_digest(path), None)
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+MODEL_CACHE = ModelCache()
+
+
+class DMatrixCache(object):
+    """
+    A local, content-addressed cache of parsed datasets, stored in XGBoost's binary DMatrix format.
+
+    Datasets are keyed on the digest of the source file together with the label column and the format it was parsed
+    with, so a file that changes is parsed again. Once the cache grows beyond its maximum size, the least recently
+    used datasets are deleted. The cache lives on disk, so it is shared by every process using the same directory.
+
+    Args:
+        directory: Directory the binary datasets are stored in.
+        max_bytes: Maximum total size of the binary datasets.
+    """
+
+    _SUFFIX = ".buffer"
+
+    def __init__(self, directory: Union[str, os.PathLike], max_bytes: int = 10 * 2**30):
+        if max_bytes < 1:
+            raise ValueError(f"max_bytes must be at least 1, got {max_bytes}")
+        self._directory = os.fspath(directory)
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    def key(self, path: Union[str, os.PathLike], label_column: int, fmt: str) -> str:
+        return hashlib.sha256(f"{file_digest(path)}:{label_column}:{fmt}".encode()).hexdigest()
+
+    def get(
+        self,
+        path: Union[str, os.PathLike],
+        label_column: int,
+        fmt: str,
+        loader: Callable[[], xgboost.DMatrix],
+    ) -> xgboost.DMatrix:
+        """
+        Returns the dataset parsed from the file, calling the loader to parse it only if it isn't cached yet.
+
+        Args:
+            path: Path of the source file.
+            label_column: Index of the column containing the labels.
+            fmt: Format the file is parsed with.
+            loader: Function that parses the file.
+        """
+        cached = os.path.join(self._directory, self.key(path, label_column, fmt) + self._SUFFIX)
+        if os.path.exists(cached):
+            try:
+                self._touch(cached)
+                dmatrix = xgboost.DMatrix(cached)
+            except (OSError, xgboost.core.XGBoostError):
+                # Evicted by another process in the meantime
+                pass
+            else:
+                with self._lock:
+                    self.hits += 1
+                return dmatrix
+
+        with self._lock:
+            self.misses += 1
+        dmatrix = loader()
+        os.makedirs(self._directory, exist_ok=True)
+        # Write to a temporary file first, so that other processes never load a partially written dataset
+        partial = os.path.join(self._directory, f".{uuid.uuid4().hex}.partial")
+        dmatrix.save_binary(partial)
+        os.replace(partial, cached)
+        self._touch(cached)
+        self.evict()
+        return dmatrix
+
+    def size(self) -> int:
+        """
+        Returns the total size of the cached datasets, in bytes
+        """
+        return sum(os.path.getsize(path) for path in self._entries())
+
+    def evict(self):
+        """
+        Deletes the least recently used datasets until the cache fits in its maximum size
+        """
+        with self._lock:
+            entries = []
+            for path in self._entries():
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self._max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def clear(self):
+        """
+        Deletes every cached dataset
+        """
+        with self._lock:
+            for path in self._entries():
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    @staticmethod
+    def _touch(path: str):
+        # Mark the dataset as recently used. The clock the file system stamps files with is too coarse to order
+        # datasets used in quick succession, so set the time explicitly.
+        now = time.time_ns()
+        os.utime(path, ns=(now, now))
+
+    def _entries(self):
+        if not os.path.isdir(self._directory):
+            return []
+        with os.scandir(self._directory) as it:
+            return [entry.path for entry in it if entry.name.endswith(self._SUFFIX)]
+
+
+DMATRIX_CACHE = DMatrixCache(os.path.join(tempfile.gettempdir(), "flytekitplugins-xgboost", "dmatrix"))
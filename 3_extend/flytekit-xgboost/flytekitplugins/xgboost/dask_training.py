@@ -0,0 +1,114 @@
+import operator
+import os
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import xgboost
+
+from .data import schema_files
+
+# Dask is an optional dependency, installed with the "dask" extra
+try:
+    import dask.dataframe as dd
+    import xgboost.dask as dxgb
+    from dask.distributed import Client, LocalCluster, as_completed
+except ImportError:
+    dd = dxgb = Client = LocalCluster = as_completed = None
+
+
+def require_dask():
+    if dd is None:
+        raise ImportError("The dask mode needs Dask, install it with: pip install flytekitplugins-xgboost[dask]")
+
+
+@contextmanager
+def local_cluster(num_workers: int, nthread: int) -> Iterator["Client"]:
+    """
+    Starts a Dask cluster of num_workers local worker processes that share nthread threads, and connects to it
+    """
+    require_dask()
+    with LocalCluster(
+        n_workers=num_workers,
+        threads_per_worker=max(1, nthread // num_workers),
+        processes=True,
+        dashboard_address=None,
+    ) as cluster, Client(cluster) as client:
+        yield client
+
+
+def parquet_files(path: Union[str, os.PathLike]) -> List[str]:
+    """
+    Lists the files of a Parquet file, or of the Parquet files of a FlyteSchema
+    """
+    path = os.fspath(path)
+    return schema_files(path) if os.path.isdir(path) else [path]
+
+
+def read_parquet(path: Union[str, os.PathLike], label_column: int) -> Tuple["dd.DataFrame", "dd.Series"]:
+    """
+    Opens a Parquet file, or the Parquet files of a FlyteSchema, as a lazy (features, labels) pair of Dask
+    collections, partitioned along the files' row groups
+    """
+    require_dask()
+    df = dd.read_parquet(parquet_files(path), split_row_groups=True)
+    label = df.columns[label_column]
+    # Split the columns inside the partitions: Dask fuses the row groups of a projection that keeps few columns, such
+    # as the label, which would leave the features and the labels with different partitions
+    return df.map_partitions(pd.DataFrame.drop, columns=[label]), df.map_partitions(operator.getitem, label)
+
+
+def dask_dmatrix(
+    client: "Client",
+    path: Union[str, os.PathLike],
+    label_column: int,
+    quantile: bool = False,
+    ref: Optional["dxgb.DaskDMatrix"] = None,
+    max_bin: int = 256,
+) -> "dxgb.DaskDMatrix":
+    """
+    Method to load a Parquet file, or the Parquet files of a FlyteSchema, as an xgboost.dask.DaskDMatrix. Every
+    worker of the cluster loads the partitions it is given, so the dataset is never held by one process. If quantile
+    is set, an xgboost.dask.DaskQuantileDMatrix of max_bin bins is built instead; validation matrices must pass the
+    training matrix as ref.
+    """
+    features, labels = read_parquet(path, label_column)
+    if quantile:
+        return dxgb.DaskQuantileDMatrix(client, features, labels, max_bin=max_bin, ref=ref)
+    return dxgb.DaskDMatrix(client, features, labels)
+
+
+def predict_partitions(
+    client: "Client",
+    booster: xgboost.Booster,
+    path: Union[str, os.PathLike],
+    label_column: int,
+    fname: Union[str, os.PathLike],
+) -> str:
+    """
+    Predicts a Parquet file, or the Parquet files of a FlyteSchema, on the cluster, and writes the predictions to a
+    float32 .npy file one partition at a time, as the workers finish them. Every partition is a row group, so the
+    offsets of the partitions are taken from the row counts in the files' metadata, without reading any data.
+    """
+    features, _ = read_parquet(path, label_column)
+    lengths = [
+        f.metadata.row_group(i).num_rows
+        for f in map(pq.ParquetFile, parquet_files(path))
+        for i in range(f.num_row_groups)
+    ]
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    y_pred = np.lib.format.open_memmap(fname, mode="w+", dtype=np.float32, shape=(int(offsets[-1]),))
+
+    partitions = dxgb.predict(client, booster, features).to_delayed()
+    futures = client.compute(partitions)
+    index = {future.key: i for i, future in enumerate(futures)}
+    for future, partition in as_completed(futures, with_results=True):
+        i = index[future.key]
+        y_pred[offsets[i]:offsets[i + 1]] = np.asarray(partition, dtype=np.float32)
+        # Drop the last reference to the partition, so that the cluster frees it
+        futures[i] = None
+    y_pred.flush()
+    del y_pred
+    return os.fspath(fname)
@@ -0,0 +1,299 @@
+import io
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import scipy.sparse
+import xgboost
+
+# Number of rows read from disk at a time when streaming a dataset
+BATCH_SIZE = 100_000
+
+
+def read_csv_batches(path: str, label_column: int, batch_size: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Reads a header-less CSV file as (features, labels) batches
+    """
+    for chunk in pd.read_csv(path, header=None, chunksize=batch_size):
+        yield _split_label(chunk.to_numpy(dtype=np.float32), label_column)
+
+
+def read_parquet_batches(
+    path: Union[str, List[str]], label_column: int, batch_size: int
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Reads one or more Parquet files as (features, labels) batches, one row group slice at a time
+    """
+    for _path in [path] if isinstance(path, str) else path:
+        for batch in pq.ParquetFile(_path).iter_batches(batch_size=batch_size):
+            yield _split_label(batch.to_pandas().to_numpy(dtype=np.float32), label_column)
+
+
+def schema_files(directory: Union[str, os.PathLike]) -> List[str]:
+    """
+    Lists the files a FlyteSchema is stored in, skipping the hidden ones as flytekit does
+    """
+    with os.scandir(directory) as it:
+        return sorted(entry.path for entry in it if not entry.name.startswith(".") and entry.is_file())
+
+
+def read_libsvm_batches(path: str, batch_size: int) -> Iterator[Tuple[scipy.sparse.csr_matrix, np.ndarray]]:
+    """
+    Reads a libsvm file as (features, labels) batches. Feature indices are used as column indices, as XGBoost does.
+    """
+    with open(path) as f:
+        while True:
+            lines = list(itertools.islice(f, batch_size))
+            if not lines:
+                return
+            yield _parse_libsvm(lines)
+
+
+def read_line_range(path: str, rank: int, world_size: int, batch_size: int) -> Iterator[List[bytes]]:
+    """
+    Reads the lines of a file that start in the rank-th of world_size equal byte ranges, in batches. Every line
+    belongs to exactly one range, so the workers of a distributed job can split a file without counting its lines.
+    """
+    size = os.path.getsize(path)
+    start, end = size * rank // world_size, size * (rank + 1) // world_size
+    with open(path, "rb") as f:
+        if start > 0:
+            # Skip the rest of the line that started in the previous range
+            f.seek(start - 1)
+            f.readline()
+        while True:
+            lines = []
+            while len(lines) < batch_size and f.tell() < end:
+                line = f.readline()
+                if not line:
+                    break
+                lines.append(line)
+            if not lines:
+                return
+            yield lines
+
+
+def read_csv_shard(
+    path: str, label_column: int, rank: int, world_size: int, batch_size: int
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Reads the rank-th of world_size shards of a header-less CSV file as (features, labels) batches
+    """
+    for lines in read_line_range(path, rank, world_size, batch_size):
+        chunk = pd.read_csv(io.BytesIO(b"".join(lines)), header=None)
+        yield _split_label(chunk.to_numpy(dtype=np.float32), label_column)
+
+
+def read_libsvm_shard(
+    path: str, rank: int, world_size: int, batch_size: int
+) -> Iterator[Tuple[scipy.sparse.csr_matrix, np.ndarray]]:
+    """
+    Reads the rank-th of world_size shards of a libsvm file as (features, labels) batches
+    """
+    for lines in read_line_range(path, rank, world_size, batch_size):
+        yield _parse_libsvm([line.decode() for line in lines])
+
+
+def read_parquet_shard(
+    path: Union[str, List[str]], label_column: int, rank: int, world_size: int, batch_size: int
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Reads the rank-th of world_size equal row ranges of one or more Parquet files as (features, labels) batches. The
+    ranges are cut from the row counts in the files' metadata, and only the row groups that overlap a range are read,
+    so the shards stay balanced however few row groups the files have.
+    """
+    files = [pq.ParquetFile(_path) for _path in ([path] if isinstance(path, str) else path)]
+    num_rows = sum(f.metadata.num_rows for f in files)
+    start, end = num_rows * rank // world_size, num_rows * (rank + 1) // world_size
+    # Index of the first row of the current row group, counted across all the files
+    offset = 0
+    for f in files:
+        for i in range(f.num_row_groups):
+            row = offset
+            offset += f.metadata.row_group(i).num_rows
+            if offset <= start or row >= end:
+                continue
+            for batch in f.iter_batches(batch_size=batch_size, row_groups=[i]):
+                first, last = max(start - row, 0), min(end - row, batch.num_rows)
+                row += batch.num_rows
+                if first < last:
+                    batch = batch.slice(first, last - first)
+                    yield _split_label(batch.to_pandas().to_numpy(dtype=np.float32), label_column)
+
+
+def _split_label(values: np.ndarray, label_column: int) -> Tuple[np.ndarray, np.ndarray]:
+    return np.delete(values, label_column, axis=1), values[:, label_column]
+
+
+def _parse_libsvm(lines: List[str]) -> Tuple[scipy.sparse.csr_matrix, np.ndarray]:
+    labels, indptr, indices, values = [], [0], [], []
+    for line in lines:
+        tokens = line.split("#", 1)[0].split()
+        if not tokens:
+            continue
+        labels.append(float(tokens[0]))
+        for token in tokens[1:]:
+            index, value = token.split(":", 1)
+            # Skip the query ids of ranking datasets
+            if index != "qid":
+                indices.append(int(index))
+                values.append(float(value))
+        indptr.append(len(indices))
+    num_features = max(indices) + 1 if indices else 0
+    features = scipy.sparse.csr_matrix(
+        (np.asarray(values, dtype=np.float32), np.asarray(indices), np.asarray(indptr)),
+        shape=(len(labels), num_features),
+    )
+    return features, np.asarray(labels, dtype=np.float32)
+
+
+class BatchIter(xgboost.DataIter):
+    """
+    An XGBoost data iterator that streams a dataset from disk one batch at a time.
+
+    XGBoost goes through the iterator to build its own compressed pages, which are cached on disk under the cache
+    prefix (or kept in memory by a QuantileDMatrix), so only one batch of the source file is held in memory at a
+    time.
+
+    Args:
+        read_batches: Function that returns a new iterator over the (features, labels) batches.
+        cache_prefix: Path prefix of the pages XGBoost caches on disk, if any.
+    """
+
+    def __init__(self, read_batches: Callable[[], Iterator[Tuple]], cache_prefix: Optional[str] = None):
+        self._read_batches = read_batches
+        self._batches = None
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data: Callable) -> bool:
+        if self._batches is None:
+            self._batches = self._read_batches()
+        batch = next(self._batches, None)
+        if batch is None:
+            return False
+        features, labels = batch
+        input_data(data=features, label=labels)
+        return True
+
+    def reset(self):
+        self._batches = None
+
+
+def file_batches(
+    path: Union[str, os.PathLike], extension: str, label_column: int, batch_size: int = BATCH_SIZE
+) -> Callable[[], Iterator[Tuple]]:
+    """
+    Returns a function that starts reading a CSV, Parquet or libsvm file in batches
+    """
+    path = os.fspath(path)
+    if extension == "csv":
+        return lambda: read_csv_batches(path, label_column, batch_size)
+    if extension == "parquet":
+        return lambda: read_parquet_batches(path, label_column, batch_size)
+    return lambda: read_libsvm_batches(path, batch_size)
+
+
+def schema_batches(
+    directory: Union[str, os.PathLike], label_column: int, batch_size: int = BATCH_SIZE
+) -> Callable[[], Iterator[Tuple]]:
+    """
+    Returns a function that starts reading the Parquet files of a FlyteSchema in batches
+    """
+    paths = schema_files(directory)
+    return lambda: read_parquet_batches(paths, label_column, batch_size)
+
+
+def shard_batches(
+    path: Union[str, os.PathLike],
+    extension: str,
+    label_column: int,
+    rank: int,
+    world_size: int,
+    batch_size: int = BATCH_SIZE,
+) -> Callable[[], Iterator[Tuple]]:
+    """
+    Returns a function that starts reading the rank-th of world_size shards of a CSV, Parquet or libsvm file in
+    batches. A directory is read as the Parquet files of a FlyteSchema.
+    """
+    path = os.fspath(path)
+    if os.path.isdir(path):
+        paths = schema_files(path)
+        return lambda: read_parquet_shard(paths, label_column, rank, world_size, batch_size)
+    if extension == "csv":
+        return lambda: read_csv_shard(path, label_column, rank, world_size, batch_size)
+    if extension == "parquet":
+        return lambda: read_parquet_shard(path, label_column, rank, world_size, batch_size)
+    return lambda: read_libsvm_shard(path, rank, world_size, batch_size)
+
+
+def batches_dmatrix(read_batches: Callable[[], Iterator[Tuple]]) -> xgboost.DMatrix:
+    """
+    Method to load all the batches in memory as one xgboost.DMatrix
+    """
+    features, labels = [], []
+    for x, y in read_batches():
+        features.append(x)
+        labels.append(y)
+    if features and scipy.sparse.issparse(features[0]):
+        # libsvm batches are as wide as the largest feature index they contain
+        num_features = max(x.shape[1] for x in features)
+        for x in features:
+            x.resize((x.shape[0], num_features))
+        return xgboost.DMatrix(scipy.sparse.vstack(features, format="csr"), np.concatenate(labels))
+    if not features:
+        return xgboost.DMatrix(np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=np.float32))
+    return xgboost.DMatrix(np.concatenate(features), np.concatenate(labels))
+
+
+def external_memory_dmatrix(
+    path: Union[str, os.PathLike],
+    extension: str,
+    label_column: int,
+    cache_prefix: str,
+    batch_size: int = BATCH_SIZE,
+) -> xgboost.DMatrix:
+    """
+    Method to load a CSV, Parquet or libsvm file as an external memory xgboost.DMatrix
+    """
+    return xgboost.DMatrix(BatchIter(file_batches(path, extension, label_column, batch_size), cache_prefix))
+
+
+def quantile_dmatrix(
+    read_batches: Callable[[], Iterator[Tuple]], ref: Optional[xgboost.DMatrix] = None, max_bin: int = 256
+) -> xgboost.QuantileDMatrix:
+    """
+    Method to build an xgboost.QuantileDMatrix from batches. XGBoost sketches the quantiles of every feature over
+    the batches, then stores the data as bin indices, so only one batch of the raw data is held in memory at a time.
+    Matrices used for validation or prediction must pass the training matrix as ref, to share its quantiles. The
+    number of bins must be the max_bin the model is trained with.
+    """
+    return xgboost.QuantileDMatrix(BatchIter(read_batches), ref=ref, max_bin=max_bin)
+
+
+class Prefetcher(object):
+    """
+    Downloads files concurrently on a thread pool, starting as soon as it is created, so that a file can be used as
+    soon as it has arrived while the other ones are still downloading.
+
+    Args:
+        files: Files to download (anything with a download() method, such as FlyteFiles), by name.
+    """
+
+    def __init__(self, files: Dict[str, Any]):
+        pool = ThreadPoolExecutor(max_workers=max(len(files), 1))
+        self._downloads = {name: pool.submit(f.download) for name, f in files.items()}
+        # The pool's threads exit once the downloads are done
+        pool.shutdown(wait=False)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._downloads
+
+    def wait(self, name: str) -> str:
+        """
+        Waits for a file to be downloaded and returns its local path, raising the download's error if it failed
+        """
+        return self._downloads[name].result()
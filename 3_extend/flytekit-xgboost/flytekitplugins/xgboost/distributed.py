@@ -0,0 +1,101 @@
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import xgboost
+from xgboost.tracker import RabitTracker
+
+from .data import batches_dmatrix, shard_batches
+from .threads import spawn_pool
+
+# A dataset a worker loads its shard of: the local path of the file (or of the directory of a FlyteSchema), and its
+# extension
+Dataset = Tuple[str, str]
+
+
+def train_worker(
+    rank: int,
+    world_size: int,
+    tracker_args: Dict[str, Union[int, str]],
+    train: Dataset,
+    validation: Optional[Dataset],
+    label_column: int,
+    hyper_parameters: Dict[str, Any],
+    model_parameters: Dict[str, Any],
+    xgb_model: Optional[xgboost.Booster] = None,
+) -> Optional[Tuple[bytes, Dict[str, Dict[str, List[float]]]]]:
+    """
+    Trains one worker of a distributed job on its shard of the datasets. The workers build the same model together,
+    synchronizing the feature quantiles and the gradient histograms through the tracker, and the first worker
+    returns it in the UBJSON format, along with the evaluation result on the whole validation dataset.
+
+    Args:
+        rank: Index of the worker.
+        world_size: Number of workers.
+        tracker_args: Arguments to connect to the tracker, from RabitTracker.worker_args().
+        train: Train dataset.
+        validation: Validation dataset, if any.
+        label_column: Index of the column containing the labels.
+        hyper_parameters: Parameters of xgboost.train().
+        model_parameters: Keyword arguments of xgboost.train().
+        xgb_model: Model to continue boosting from.
+    """
+    with xgboost.collective.CommunicatorContext(**tracker_args, dmlc_task_id=str(rank)):
+        dtrain = batches_dmatrix(shard_batches(*train, label_column, rank, world_size))
+        evals = None
+        if validation:
+            evals = [(batches_dmatrix(shard_batches(*validation, label_column, rank, world_size)), "validation")]
+        evals_result = {}
+        booster = xgboost.train(
+            params=hyper_parameters,
+            dtrain=dtrain,
+            **model_parameters,
+            evals=evals,
+            evals_result=evals_result,
+            xgb_model=xgb_model,
+        )
+        if xgboost.collective.get_rank() != 0:
+            return None
+        return bytes(booster.save_raw("ubj")), evals_result
+
+
+def train_distributed(
+    num_workers: int,
+    train: Dataset,
+    validation: Optional[Dataset],
+    label_column: int,
+    hyper_parameters: Dict[str, Any],
+    model_parameters: Dict[str, Any],
+    xgb_model: Optional[xgboost.Booster] = None,
+    host_ip: str = "127.0.0.1",
+) -> Tuple[bytes, Dict[str, Dict[str, List[float]]]]:
+    """
+    Trains a model on num_workers local processes, each loading 1 / num_workers of the datasets, and returns it in
+    the UBJSON format along with the evaluation result on the validation dataset. The threads are split between the
+    workers.
+    """
+    if hyper_parameters.get("tree_method") == "exact":
+        raise ValueError('Distributed training does not support the "exact" tree method')
+    hyper_parameters = {**hyper_parameters, "nthread": max(1, hyper_parameters.get("nthread", 1) // num_workers)}
+
+    tracker = RabitTracker(n_workers=num_workers, host_ip=host_ip, sortby="task")
+    tracker.start()
+    tracker_args = tracker.worker_args()
+    with spawn_pool(num_workers) as pool:
+        futures = [
+            pool.submit(
+                train_worker,
+                rank,
+                num_workers,
+                tracker_args,
+                train,
+                validation,
+                label_column,
+                hyper_parameters,
+                model_parameters,
+                xgb_model,
+            )
+            for rank in range(num_workers)
+        ]
+        results = [future.result() for future in futures]
+    tracker.wait_for()
+
+    return next(result for result in results if result is not None)
@@ -0,0 +1,273 @@
+import itertools
+import math
+import random
+from dataclasses import asdict, dataclass, fields, replace
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Type, Union
+
+import flytekit
+import xgboost
+from dataclasses_json import dataclass_json
+from flytekit.types.file.file import FlyteFile
+from flytekit.types.schema.types import FlyteSchema
+
+from .task_sln import HyperParameters, ModelParameters, NumpyFile, XGBoostParameters, XGBoostTrainerTask, load_booster
+from .threads import available_cpus, limit_threads, spawn_pool
+
+# Metrics for which a higher score is better, every other metric is minimized. Ranking metrics may be suffixed with
+# a cut-off, such as "ndcg@10".
+_MAXIMIZED_METRICS = {"auc", "aucpr", "map", "ndcg", "pre"}
+
+
+@dataclass_json
+@dataclass
+class Trial(object):
+    """
+    A row of the leaderboard of a hyperparameter search.
+
+    Args:
+        trial: Index of the trial, in the order the configurations were generated.
+        hyper_parameters: Hyperparameters of the trial.
+        num_boost_round: Number of boosting iterations the trial was trained for before it was stopped.
+        metric: Name of the validation metric the trial was scored on.
+        score: Validation score after the last boosting iteration.
+    """
+
+    trial: int
+    hyper_parameters: HyperParameters
+    num_boost_round: int
+    metric: str
+    score: float
+
+
+# Every worker process loads the binary train and validation matrices once, then trains all of its trials on them
+_worker_data: Dict[str, xgboost.DMatrix] = {}
+
+
+def _init_worker(train: str, validation: str):
+    _worker_data["train"] = xgboost.DMatrix(train)
+    _worker_data["validation"] = xgboost.DMatrix(validation)
+
+
+def _train_trial(
+    hyper_parameters: Dict[str, Any], num_boost_round: int, model: Optional[bytes]
+) -> Tuple[bytes, Dict[str, Dict[str, List[float]]]]:
+    """
+    Trains num_boost_round more rounds, continuing from the model if any, and returns the model and the evaluation
+    result on the validation matrix
+    """
+    evals_result = {}
+    booster = xgboost.train(
+        params=hyper_parameters,
+        dtrain=_worker_data["train"],
+        num_boost_round=num_boost_round,
+        evals=[(_worker_data["validation"], "validation")],
+        evals_result=evals_result,
+        verbose_eval=False,
+        xgb_model=load_booster(model) if model else None,
+    )
+    return bytes(booster.save_raw("ubj")), evals_result
+
+
+def _score(evals_result: Dict[str, Dict[str, List[float]]]) -> Tuple[str, float]:
+    # Like early stopping, score on the last metric
+    metric, history = list(evals_result["validation"].items())[-1]
+    return metric, float(history[-1])
+
+
+class XGBoostSearchTask(XGBoostTrainerTask):
+    """
+    A task that searches the hyperparameters of an XGBoost model.
+
+    The train and validation datasets are downloaded and parsed once, then every trial is trained on a local process
+    pool that loads them in XGBoost's binary format. With successive halving, every trial is first trained for
+    min_boost_round rounds, then only the best 1 / reduction_factor trials keep training, for reduction_factor times
+    more rounds, and so on until num_boost_round rounds (from the model parameters) are reached. Once a single trial
+    is left, it is trained for the remaining rounds at once, so the best model always has num_boost_round rounds.
+    """
+
+    _OUTPUT_LEADERBOARD = "leaderboard"
+
+    _STRATEGIES = ("grid", "random")
+
+    def __init__(
+            self,
+            name: str,
+            search_space: Dict[str, Union[List[Any], Tuple[float, float]]],
+            dataset_type: Union[Type[FlyteFile], Type[FlyteSchema]] = FlyteFile,
+            config: Optional[XGBoostParameters] = None,
+            strategy: str = "grid",
+            num_trials: int = 10,
+            seed: Optional[int] = None,
+            max_workers: Optional[int] = None,
+            successive_halving: bool = False,
+            min_boost_round: int = 1,
+            reduction_factor: int = 3,
+            model_format: str = "joblib",
+            prefetch: bool = True,
+            cache_dmatrix: bool = False,
+            **kwargs,
+    ):
+        """
+        Args:
+            name: Name of the task.
+            search_space: Values of the hyperparameters to search, by name. A list gives the values to try, a
+                (low, high) tuple gives the range to sample from with the random strategy (integers if both bounds
+                are integers).
+            dataset_type: Type of the dataset. supported types are FlyteFile[csv, libsvm], FlyteSchema
+            config: Configuration for the task. The hyperparameters are the base that every trial overrides.
+            strategy: "grid" tries every combination of the values, "random" samples num_trials configurations.
+            num_trials: Number of configurations sampled by the random strategy.
+            seed: Seed of the random strategy.
+            max_workers: Number of trials trained at a time, the number of threads (nthread) by default.
+            successive_halving: Indicate if poor trials should be stopped early with successive halving.
+            min_boost_round: Number of boosting iterations every trial is trained for before the first halving.
+            reduction_factor: Fraction of the trials (1 / reduction_factor) kept at every halving.
+            model_format: Format of the best model, "joblib" or "ubj".
+            prefetch: Indicate if the FlyteFile inputs should all be downloaded concurrently.
+            cache_dmatrix: Indicate if the parsed FlyteFile datasets should be kept in the local binary cache.
+        Returns:
+            model: The best model.
+            predictions: The predictions of the best model for the test dataset, as a float32 array in a .npy file.
+            leaderboard: The trials, best first.
+        """
+        hyper_parameter_names = {f.name for f in fields(HyperParameters)}
+        unknown = set(search_space) - hyper_parameter_names
+        if unknown:
+            raise ValueError(f"Unknown hyperparameters {sorted(unknown)}, expected some of {sorted(hyper_parameter_names)}")
+        if strategy not in self._STRATEGIES:
+            raise ValueError(f"Invalid search strategy {strategy}, expected one of {list(self._STRATEGIES)}")
+        if strategy == "grid" and any(not isinstance(values, list) for values in search_space.values()):
+            raise ValueError("The grid strategy needs a list of values for every hyperparameter")
+        if reduction_factor < 2:
+            raise ValueError(f"reduction_factor must be at least 2, got {reduction_factor}")
+
+        self._search_space = search_space
+        self._strategy = strategy
+        self._num_trials = num_trials
+        self._seed = seed
+        self._max_workers = max_workers
+        self._successive_halving = successive_halving
+        self._min_boost_round = min_boost_round
+        self._reduction_factor = reduction_factor
+
+        super(XGBoostSearchTask, self).__init__(
+            name,
+            dataset_type=dataset_type,
+            validate=True,
+            config=config,
+            model_format=model_format,
+            prefetch=prefetch,
+            cache_dmatrix=cache_dmatrix,
+            **kwargs,
+        )
+
+    def _outputs(self) -> Dict[str, Type]:
+        return {
+            self._OUTPUT_MODEL: self._MODEL_FORMATS[self._model_format],
+            self._OUTPUT_PREDICTIONS: NumpyFile,
+            self._OUTPUT_LEADERBOARD: List[Trial],
+        }
+
+    def configurations(self) -> List[Dict[str, Any]]:
+        """
+        Returns the hyperparameter values of every trial
+        """
+        names = list(self._search_space)
+        if self._strategy == "grid":
+            return [dict(zip(names, values)) for values in itertools.product(*self._search_space.values())]
+
+        rng = random.Random(self._seed)
+
+        def sample(values: Union[List[Any], Tuple[float, float]]) -> Any:
+            if isinstance(values, list):
+                return rng.choice(values)
+            low, high = values
+            if isinstance(low, int) and isinstance(high, int):
+                return rng.randint(low, high)
+            return rng.uniform(low, high)
+
+        return [{name: sample(self._search_space[name]) for name in names} for _ in range(self._num_trials)]
+
+    def search(self, train: str, validation: str, params: XGBoostParameters) -> Tuple[List[Trial], bytes]:
+        """
+        Trains the trials on the binary train and validation matrices, and returns the leaderboard and the best model
+        """
+        base = params.hyper_parameters if params.hyper_parameters else HyperParameters()
+        model_parameters = params.model_parameters if params.model_parameters else ModelParameters()
+        trials = [replace(base, **values) for values in self.configurations()]
+        threads = base.nthread if base.nthread > 0 else available_cpus(self.cpu_resource())
+        max_workers = self._max_workers or threads
+        # Split the threads between the trials trained at the same time
+        nthread = max(1, threads // min(max_workers, max(len(trials), 1)))
+
+        max_rounds = model_parameters.num_boost_round
+        rounds = min(self._min_boost_round, max_rounds) if self._successive_halving else max_rounds
+        trained = [0] * len(trials)
+        models: List[Optional[bytes]] = [None] * len(trials)
+        scores: Dict[int, Tuple[str, float]] = {}
+        survivors = list(range(len(trials)))
+
+        with spawn_pool(max_workers, initializer=_init_worker, initargs=(train, validation)) as pool:
+            while True:
+                futures = {
+                    i: pool.submit(
+                        _train_trial, {**asdict(trials[i]), "nthread": nthread}, rounds - trained[i], models[i]
+                    )
+                    for i in survivors
+                }
+                for i, future in futures.items():
+                    models[i], evals_result = future.result()
+                    trained[i] = rounds
+                    scores[i] = _score(evals_result)
+
+                if rounds >= max_rounds:
+                    break
+                survivors = sorted(survivors, key=lambda i: self._sort_key(*scores[i]))
+                survivors = survivors[: math.ceil(len(survivors) / self._reduction_factor)]
+                # Only the survivors' models are needed from now on
+                for i in range(len(models)):
+                    if i not in survivors:
+                        models[i] = None
+                rounds = max_rounds if len(survivors) == 1 else min(rounds * self._reduction_factor, max_rounds)
+
+        # Trials that were trained for longer rank first, then by their score
+        leaderboard = sorted(range(len(trials)), key=lambda i: (-trained[i], self._sort_key(*scores[i])))
+        return (
+            [
+                Trial(trial=i, hyper_parameters=trials[i], num_boost_round=trained[i], metric=scores[i][0], score=scores[i][1])
+                for i in leaderboard
+            ],
+            models[leaderboard[0]],
+        )
+
+    @staticmethod
+    def _sort_key(metric: str, score: float) -> float:
+        return -score if metric.split("@")[0] in _MAXIMIZED_METRICS else score
+
+    def execute(self, **kwargs) -> Any:
+        params = self.finalize_params(kwargs[self._PARAMS_ARG])
+        downloads = self.prefetch(**kwargs)
+        print(f"Finalized parameters = {params}")
+
+        # The workers inherit the limits of the OpenMP and BLAS thread pools
+        with limit_threads(params.hyper_parameters.nthread):
+            # STEP 1
+            # Parse the train and validation datasets once, and store them in XGBoost's binary format for the workers
+            working_dir = Path(flytekit.current_context().working_directory)
+            buffers = []
+            for name in (self._TRAIN_ARG, self._VALIDATION_ARG):
+                dmatrix = self.load(kwargs[name], name, params.label_column, downloads=downloads)
+                buffers.append(str(working_dir / f"{name}.buffer"))
+                dmatrix.save_binary(buffers[-1])
+                del dmatrix
+
+            # STEP 2
+            leaderboard, best_model = self.search(*buffers, params=params)
+            model = self.save_model(load_booster(best_model))
+
+            # STEP 3
+            dtest = self.load(kwargs[self._TEST_ARG], self._TEST_ARG, params.label_column, downloads=downloads)
+            predictions = self.test(booster_model=model, dtest=dtest)
+
+            return self._MODEL_FORMATS[self._model_format](model), NumpyFile(predictions), leaderboard
@@ -1,10 +1,12 @@
+import os
 import typing
-from dataclasses import asdict, dataclass
+from dataclasses import asdict, dataclass, replace
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple, Union
 
 import flytekit
 import joblib
+import numpy as np
 import xgboost
 from dataclasses_json import dataclass_json
 from flytekit import PythonInstanceTask
@@ -13,6 +15,17 @@ from flytekit.types.file import JoblibSerializedFile
 from flytekit.types.file.file import FlyteFile
 from flytekit.types.schema.types import FlyteSchema
 
+from .cache import DMATRIX_CACHE, MODEL_CACHE, DMatrixCache, file_digest
+from .dask_training import Client, dask_dmatrix, dxgb, local_cluster, predict_partitions, require_dask
+from .data import Prefetcher, external_memory_dmatrix, quantile_dmatrix, schema_batches
+from .distributed import train_distributed
+from .threads import available_cpus, limit_threads
+
+# XGBoost's native binary JSON (UBJSON) model format
+XGBoostModelFile = FlyteFile[typing.TypeVar("ubj")]
+# Predictions are stored as a float32 array in a .npy file
+NumpyFile = FlyteFile[typing.TypeVar("npy")]
+
 
 @dataclass_json
 @dataclass
@@ -45,12 +58,26 @@ class HyperParameters(object):
         subsample: Subsample ratio of the training instance.
         verbosity: The verbosity level.
         booster: Specifies the booster type to use.
-        tree_method: Specifies the tree construction algorithm.
+        tree_method: Specifies the tree construction algorithm, one of "auto", "exact", "approx" or "hist".
         min_child_weight: Minimum sum of instance weight(hessian) needed in a child.
+        nthread: Number of threads used to train. 0 uses as many threads as the task has CPUs, from the container's
+            CPU quota and the task's CPU resources, instead of the host's core count.
+        max_bin: Maximum number of bins features are bucketed in by the "approx" and "hist" tree methods. Fewer bins
+            train faster and use less memory, at the cost of coarser splits.
+        grow_policy: Specifies how new nodes are added to a tree. "depthwise" splits the nodes closest to the root,
+            "lossguide" splits the nodes with the highest loss change, which needs the "approx" or "hist" tree method.
+        max_leaves: Maximum number of leaves of a tree, 0 for no limit.
+        sampling_method: Specifies how the training instances are subsampled. "uniform" gives every instance the same
+            probability, "gradient_based" favours the instances with large gradients and needs the "hist" tree method
+            (or "auto", which is "hist" since XGBoost 2.0), on a CPU as well as on a GPU.
 
     NOTE: There are a lot more hyperparameters available. We are using only a couple of them for demo purposes.
     """
 
+    _TREE_METHODS = ("auto", "exact", "approx", "hist")
+    _GROW_POLICIES = ("depthwise", "lossguide")
+    _SAMPLING_METHODS = ("uniform", "gradient_based")
+
     verbosity: int = 2
     objective: str = "reg:squarederror"
     eta: float = 0.3
@@ -60,6 +87,29 @@ class HyperParameters(object):
     booster: str = "gbtree"
     tree_method: str = "auto"
     min_child_weight: int = 1
+    nthread: int = 0
+    max_bin: int = 256
+    grow_policy: str = "depthwise"
+    max_leaves: int = 0
+    sampling_method: str = "uniform"
+
+    def __post_init__(self):
+        if self.tree_method not in self._TREE_METHODS:
+            raise ValueError(f"Invalid tree method {self.tree_method}, expected one of {list(self._TREE_METHODS)}")
+        if self.grow_policy not in self._GROW_POLICIES:
+            raise ValueError(f"Invalid grow policy {self.grow_policy}, expected one of {list(self._GROW_POLICIES)}")
+        if self.sampling_method not in self._SAMPLING_METHODS:
+            raise ValueError(
+                f"Invalid sampling method {self.sampling_method}, expected one of {list(self._SAMPLING_METHODS)}"
+            )
+        if self.max_bin < 2:
+            raise ValueError(f"max_bin must be at least 2, got {self.max_bin}")
+        if self.max_leaves < 0:
+            raise ValueError(f"max_leaves must be at least 0, got {self.max_leaves}")
+        if self.grow_policy == "lossguide" and self.tree_method == "exact":
+            raise ValueError('The "lossguide" grow policy needs the "approx" or "hist" tree method')
+        if self.sampling_method == "gradient_based" and self.tree_method not in ("auto", "hist"):
+            raise ValueError('The "gradient_based" sampling method needs the "hist" tree method')
 
 
 @dataclass_json
@@ -79,27 +129,68 @@ class XGBoostParameters():
     label_column: int = 0
 
 
-def load_flytefile(dataset: FlyteFile, label_column: int) -> xgboost.DMatrix:
+def load_flytefile(
+    dataset: FlyteFile,
+    label_column: int,
+    cache_prefix: Optional[str] = None,
+    cache: Optional[DMatrixCache] = None,
+    client: Optional["Client"] = None,
+    quantile: bool = False,
+    ref: Optional["dxgb.DaskDMatrix"] = None,
+    max_bin: int = 256,
+) -> xgboost.DMatrix:
     """
-    Method to load a FlyteFile as a xgboost.DMatrix
+    Method to load a FlyteFile as a xgboost.DMatrix. If a cache prefix is given, the file is streamed from disk into
+    an external memory DMatrix cached under that prefix, instead of being loaded in memory. If a DMatrix cache is
+    given, a file that was parsed before is loaded from the cache instead of being parsed again. If a Dask client is
+    given, a Parquet file is opened as an xgboost.dask.DaskDMatrix (see dask_dmatrix) instead.
     """
     filepath = dataset.download()
 
+    # Open Parquet with Dask
+    if client is not None:
+        if dataset.extension() != "parquet":
+            raise ValueError(f"The dask mode only supports Parquet files, got {dataset.extension()}")
+        return dask_dmatrix(client, filepath, label_column, quantile, ref=ref, max_bin=max_bin)
+
+    # Stream CSV, Parquet or libSVM
+    if cache_prefix:
+        return external_memory_dmatrix(filepath, dataset.extension(), label_column, cache_prefix)
+
     # Load CSV
     if dataset.extension() == "csv":
-        return xgboost.DMatrix(
-            filepath
-            + "?format=csv&label_column="
-            + str(label_column)
-        )
+        fmt = "csv"
+        uri = filepath + "?format=csv&label_column=" + str(label_column)
     # Load libSVM
-    return xgboost.DMatrix(filepath)
-
-
-def load_flyteschema(dataset: FlyteSchema, label_column: int) -> xgboost.DMatrix:
+    else:
+        fmt = "libsvm"
+        uri = filepath + "?format=libsvm"
+    if cache is not None:
+        return cache.get(filepath, label_column, fmt, loader=lambda: xgboost.DMatrix(uri))
+    return xgboost.DMatrix(uri)
+
+
+def load_flyteschema(
+    dataset: FlyteSchema,
+    label_column: int,
+    quantile: bool = False,
+    ref: Optional[xgboost.DMatrix] = None,
+    max_bin: int = 256,
+    client: Optional["Client"] = None,
+) -> xgboost.DMatrix:
     """
-    Methods to load a FlyteSchema as an xgboost.DMatrix
+    Methods to load a FlyteSchema as an xgboost.DMatrix. If quantile is set, the Parquet files of the schema are read
+    in batches into an xgboost.QuantileDMatrix of max_bin bins instead of being loaded as a whole DataFrame;
+    validation and test matrices must pass the training matrix as ref. If a Dask client is given, the Parquet files
+    are opened as a dask.dataframe and loaded by the workers of the cluster into an xgboost.dask.DaskDMatrix (or
+    DaskQuantileDMatrix) instead.
     """
+    if client is not None:
+        return dask_dmatrix(client, dataset.open().from_path, label_column, quantile, ref=ref, max_bin=max_bin)
+
+    if quantile:
+        return quantile_dmatrix(schema_batches(dataset.open().from_path, label_column), ref=ref, max_bin=max_bin)
+
     # Load as a pandas DataFrame
     df = dataset.open().all()
     target = df[df.columns[label_column]]
@@ -107,23 +198,68 @@ def load_flyteschema(dataset: FlyteSchema, label_column: int) -> xgboost.DMatrix
     return xgboost.DMatrix(df.values, target.values)
 
 
+def load_booster(model: Union[bytes, bytearray, memoryview, str, os.PathLike]) -> xgboost.Booster:
+    """
+    Method to load a booster saved in the native UBJSON format, either from a file or from a memory buffer
+    """
+    if isinstance(model, (str, os.PathLike)):
+        with open(model, "rb") as f:
+            model = f.read()
+    booster = xgboost.Booster()
+    booster.load_model(bytearray(model))
+    return booster
+
+
+def model_lineage(booster: xgboost.Booster) -> List[str]:
+    """
+    Method to get the digests of the models a warm-started booster was trained from, oldest first
+    """
+    lineage = booster.attr("lineage")
+    return lineage.split(",") if lineage else []
+
+
+def plain_evals_result(evals_result: Dict[str, Dict[str, List[float]]]) -> Dict[str, Dict[str, List[float]]]:
+    """
+    Method to copy an evaluation history into plain dicts of lists of floats. XGBoost records it in OrderedDicts,
+    which flytekit's type engine doesn't accept as a Dict output.
+    """
+    return {
+        name: {metric: [float(value) for value in values] for metric, values in metrics.items()}
+        for name, metrics in evals_result.items()
+    }
+
+
 class XGBoostTrainerTask(PythonInstanceTask[XGBoostParameters]):
     _TASK_TYPE = "xgboost"
     _PARAMS_ARG = "params"
     _TRAIN_ARG = "train"
     _TEST_ARG = "test"
     _VALIDATION_ARG = "validation"
+    _PREVIOUS_MODEL_ARG = "previous_model"
 
     _OUTPUT_MODEL = "model"
     _OUTPUT_PREDICTIONS = "predictions"
     _OUTPUT_EVAL_RESULT = "evaluation_result"
 
+    _MODEL_FORMATS = {
+        "joblib": JoblibSerializedFile,
+        "ubj": XGBoostModelFile,
+    }
+
     def __init__(
             self,
             name: str,
             dataset_type: typing.Union[typing.Type[FlyteFile], typing.Type[FlyteSchema]] = typing.Type[FlyteFile],
             validate: bool = False,
             config: Optional[XGBoostParameters] = None,
+            model_format: str = "joblib",
+            warm_start: bool = False,
+            external_memory: bool = False,
+            quantile_dmatrix: bool = False,
+            prefetch: bool = True,
+            cache_dmatrix: bool = False,
+            num_workers: int = 1,
+            dask: bool = False,
             **kwargs,
     ):
         """
@@ -134,13 +270,59 @@ class XGBoostTrainerTask(PythonInstanceTask[XGBoostParameters]):
             dataset_type: Type of the dataset. supported types are FlyteFile[csv, libsvm], FlyteSchema
             validate: Indicate if a validation dataset will be provided
             config: Configuration for the task.
+            model_format: Format of the model output. "joblib" pickles the booster, "ubj" uses XGBoost's native
+                UBJSON format, which is smaller, faster to load and independent of the Python version.
+            warm_start: Indicate if a previous model (in the same format) will be provided. Training continues
+                boosting from it on the new data, and the digests of the model's ancestors are recorded in the
+                "lineage" attribute of the new model (see model_lineage).
+            external_memory: Indicate if FlyteFile datasets should be streamed from disk in batches instead of
+                loaded in memory, to train on datasets larger than the memory. CSV, Parquet and libsvm files are
+                supported.
+            quantile_dmatrix: Indicate if FlyteSchema datasets should be read in batches into a QuantileDMatrix,
+                which holds one batch of the raw data plus the quantized matrix in memory instead of the whole
+                DataFrame and its copies. It only supports the "hist" tree method, which "auto" is mapped to.
+            prefetch: Indicate if the FlyteFile inputs should all be downloaded concurrently as soon as the task
+                starts, rather than one after another when they are needed.
+            cache_dmatrix: Indicate if the parsed CSV and libsvm FlyteFile datasets should be kept in a local binary
+                cache (DMATRIX_CACHE), so that repeated runs on the same files, such as hyperparameter sweeps, skip
+                parsing them.
+            num_workers: Number of local worker processes to train on. With more than one, every worker loads its
+                own 1 / num_workers shard of the train and validation datasets, and the workers build the model
+                together through XGBoost's collective communication, so that the datasets don't have to fit in one
+                process. It doesn't support external_memory, quantile_dmatrix, cache_dmatrix or the "exact" tree
+                method. In the dask mode, it is the number of Dask workers.
+            dask: Indicate if the task should start a local Dask cluster and train on it with xgboost.dask. The
+                FlyteSchema or Parquet FlyteFile datasets are opened as a dask.dataframe and loaded partition by
+                partition by the workers, and the predictions are written back one partition at a time, so that no
+                dataset is held by a single DataFrame. It needs the "dask" extra and doesn't support
+                external_memory or cache_dmatrix.
         Returns:
             model: The trained model.
-            predictions: The predictions for the test dataset.
+            predictions: The predictions for the test dataset, as a float32 array in a .npy file.
             evaluation_result: The evaluation result for the validation dataset.
         """
         self._config = config
 
+        if model_format not in self._MODEL_FORMATS:
+            raise ValueError(f"Invalid model format {model_format}, expected one of {list(self._MODEL_FORMATS)}")
+        self._model_format = model_format
+        self._external_memory = external_memory
+        self._quantile_dmatrix = quantile_dmatrix
+        self._prefetch = prefetch
+        self._cache_dmatrix = cache_dmatrix
+
+        if num_workers < 1:
+            raise ValueError(f"num_workers must be at least 1, got {num_workers}")
+        if num_workers > 1 and not dask and (external_memory or quantile_dmatrix or cache_dmatrix):
+            raise ValueError("external_memory, quantile_dmatrix and cache_dmatrix aren't supported with num_workers > 1")
+        self._num_workers = num_workers
+
+        if dask:
+            require_dask()
+            if external_memory or cache_dmatrix:
+                raise ValueError("external_memory and cache_dmatrix aren't supported in the dask mode")
+        self._dask = dask
+
         self._dataset_type = dataset_type
         inputs = {
             self._TRAIN_ARG: dataset_type,
@@ -152,80 +334,338 @@ class XGBoostTrainerTask(PythonInstanceTask[XGBoostParameters]):
         if validate:
             inputs[self._VALIDATION_ARG] = dataset_type
 
-        outputs = {
-            self._OUTPUT_MODEL: JoblibSerializedFile,
-            self._OUTPUT_PREDICTIONS: List[float],
-            self._OUTPUT_EVAL_RESULT: Dict[str, Dict[str, List[float]]],
-        }
+        self._warm_start = warm_start
+        if warm_start:
+            inputs[self._PREVIOUS_MODEL_ARG] = self._MODEL_FORMATS[model_format]
 
         super(XGBoostTrainerTask, self).__init__(
             name,
             task_type=self._TASK_TYPE,
             task_config=config,
-            interface=Interface(inputs=inputs, outputs=outputs),
+            interface=Interface(inputs=inputs, outputs=self._outputs()),
             **kwargs,
         )
 
+    def _outputs(self) -> Dict[str, typing.Type]:
+        return {
+            self._OUTPUT_MODEL: self._MODEL_FORMATS[self._model_format],
+            self._OUTPUT_PREDICTIONS: NumpyFile,
+            self._OUTPUT_EVAL_RESULT: Dict[str, Dict[str, List[float]]],
+        }
+
     # Train method
-    def train(self, dtrain: xgboost.DMatrix, dvalid: xgboost.DMatrix, params: XGBoostParameters) -> Tuple[str, Dict[str, Dict[str, List[float]]]]:
+    def train(
+        self,
+        dtrain: xgboost.DMatrix,
+        dvalid: xgboost.DMatrix,
+        params: XGBoostParameters,
+        previous_model: Optional[str] = None,
+        client: Optional["Client"] = None,
+    ) -> Tuple[str, Dict[str, Dict[str, List[float]]]]:
         evals_result = {}
         # if validation data is provided, then populate evals and evals_result
         validation = None
         if dvalid:
             validation = [(dvalid, "validation")]
 
-        booster_model = xgboost.train(
-            params=asdict(params.hyper_parameters if params.hyper_parameters else HyperParameters()),
-            dtrain=dtrain,
-            **asdict(params.model_parameters if params.model_parameters else ModelParameters()),
-            evals=validation,
-            evals_result=evals_result,
+        # if a previous model is provided, then continue boosting from it
+        xgb_model = None
+        if previous_model:
+            xgb_model = self.load_model(previous_model)
+
+        hyper_parameters = asdict(params.hyper_parameters if params.hyper_parameters else HyperParameters())
+        # a QuantileDMatrix only supports the hist tree method
+        if isinstance(dtrain, xgboost.QuantileDMatrix) or (client is not None and self._quantile_dmatrix):
+            if hyper_parameters["tree_method"] not in ("auto", "hist"):
+                raise ValueError(f'quantile_dmatrix needs the "hist" tree method, got {hyper_parameters["tree_method"]}')
+            hyper_parameters["tree_method"] = "hist"
+
+        model_parameters = asdict(params.model_parameters if params.model_parameters else ModelParameters())
+        # if a Dask client is provided, then train on its cluster
+        if client is not None:
+            output = dxgb.train(
+                client,
+                hyper_parameters,
+                dtrain,
+                **model_parameters,
+                evals=validation,
+                xgb_model=xgb_model,
+            )
+            booster_model, evals_result = output["booster"], output["history"]
+        else:
+            booster_model = xgboost.train(
+                params=hyper_parameters,
+                dtrain=dtrain,
+                **model_parameters,
+                evals=validation,
+                evals_result=evals_result,
+                xgb_model=xgb_model,
+            )
+        if xgb_model is not None:
+            booster_model.set_attr(lineage=",".join(model_lineage(xgb_model) + [file_digest(previous_model)]))
+        return self.save_model(booster_model), plain_evals_result(evals_result)
+
+    def train_distributed(
+        self,
+        train: Tuple[str, str],
+        validation: Optional[Tuple[str, str]],
+        params: XGBoostParameters,
+        previous_model: Optional[str] = None,
+    ) -> Tuple[str, Dict[str, Dict[str, List[float]]]]:
+        """
+        Trains the model on the worker processes, given the local paths and extensions of the datasets
+        """
+        xgb_model = None
+        if previous_model:
+            xgb_model = self.load_model(previous_model)
+
+        model, evals_result = train_distributed(
+            self._num_workers,
+            train,
+            validation,
+            params.label_column,
+            asdict(params.hyper_parameters if params.hyper_parameters else HyperParameters()),
+            asdict(params.model_parameters if params.model_parameters else ModelParameters()),
+            xgb_model=xgb_model,
         )
-        fname = Path(flytekit.current_context().working_directory) / "model.joblib.dat"
-        joblib.dump(booster_model, fname)
-        return str(fname), evals_result
-
-    # Test method
-    def test(self, booster_model: str, dtest: xgboost.DMatrix) -> List[float]:
-        booster_model = joblib.load(booster_model)
-        y_pred = booster_model.predict(dtest).tolist()
-        return y_pred
+        booster_model = load_booster(model)
+        if xgb_model is not None:
+            booster_model.set_attr(lineage=",".join(model_lineage(xgb_model) + [file_digest(previous_model)]))
+        return self.save_model(booster_model), plain_evals_result(evals_result)
+
+    def save_model(self, booster_model: xgboost.Booster) -> str:
+        working_dir = Path(flytekit.current_context().working_directory)
+        if self._model_format == "ubj":
+            fname = working_dir / "model.ubj"
+            booster_model.save_model(str(fname))
+        else:
+            fname = working_dir / "model.joblib.dat"
+            joblib.dump(booster_model, fname)
+        return str(fname)
 
-    def execute(self, **kwargs) -> Any:
-        params: XGBoostParameters = kwargs[self._PARAMS_ARG]
-        test = kwargs[self._TEST_ARG]
-        train = kwargs[self._TRAIN_ARG]
-        if self._validate:
-            valid = kwargs[self._VALIDATION_ARG]
+    def load_model(self, model: str) -> xgboost.Booster:
+        if self._model_format == "ubj":
+            return load_booster(model)
+        return joblib.load(model)
 
+    # Test method
+    def test(self, booster_model: str, dtest: xgboost.DMatrix) -> str:
+        # Repeated calls with the same model skip loading it again
+        booster_model = MODEL_CACHE.get(booster_model, loader=self.load_model)
+        y_pred = booster_model.predict(dtest)
+        fname = Path(flytekit.current_context().working_directory) / "predictions.npy"
+        np.save(fname, y_pred.astype(np.float32, copy=False))
+        return str(fname)
+
+    def finalize_params(self, params: XGBoostParameters) -> XGBoostParameters:
+        """
+        Fills the parameters that are not given with the ones the task was configured with, and the number of threads
+        """
         if not params.model_parameters:
             params.model_parameters = self._config.model_parameters
         if not params.hyper_parameters:
             params.hyper_parameters = self._config.hyper_parameters
+        hyper_parameters = params.hyper_parameters if params.hyper_parameters else HyperParameters()
+        if hyper_parameters.nthread <= 0:
+            hyper_parameters = replace(hyper_parameters, nthread=available_cpus(self.cpu_resource()))
+        params.hyper_parameters = hyper_parameters
+        return params
 
-        print(f"Finalized parameters = {params}")
+    def cpu_resource(self) -> Optional[Union[str, int, float]]:
+        """
+        Returns the CPUs the task is limited to, or requests if it has no limit
+        """
+        return self.resources.limits.cpu or self.resources.requests.cpu
 
-        # STEP 1
-        dvalid = None
+    def prefetch(self, **kwargs) -> Optional[Prefetcher]:
+        """
+        Starts downloading all the FlyteFile inputs at once
+        """
+        if not self._prefetch:
+            return None
+        return Prefetcher({name: value for name, value in kwargs.items() if isinstance(value, FlyteFile)})
+
+    def load(
+        self,
+        dataset: Union[FlyteFile, FlyteSchema],
+        name: str,
+        label_column: int,
+        ref: Optional[xgboost.DMatrix] = None,
+        downloads: Optional[Prefetcher] = None,
+        max_bin: int = 256,
+        client: Optional["Client"] = None,
+    ) -> xgboost.DMatrix:
+        if downloads is not None and name in downloads:
+            downloads.wait(name)
         if issubclass(self._dataset_type, FlyteFile):
-            dtrain = load_flytefile(train, params.label_column)
-            # We could delay the loading to reduce memory pressure
-            dtest = load_flytefile(test, params.label_column)
-            if self._validate:
-                dvalid = load_flytefile(valid, params.label_column)
-        elif issubclass(self._dataset_type, FlyteSchema):
-            dtrain = load_flyteschema(train, params.label_column)
-            # We could delay the loading to reduce memory pressure
-            dtest = load_flyteschema(test, params.label_column)
+            return load_flytefile(
+                dataset,
+                label_column,
+                self._cache_prefix(name),
+                cache=DMATRIX_CACHE if self._cache_dmatrix else None,
+                client=client,
+                quantile=self._quantile_dmatrix,
+                ref=ref,
+                max_bin=max_bin,
+            )
+        if issubclass(self._dataset_type, FlyteSchema):
+            return load_flyteschema(
+                dataset, label_column, self._quantile_dmatrix, ref=ref, max_bin=max_bin, client=client
+            )
+        raise ValueError(f"Invalid type for input")
+
+    def local_dataset(
+        self, dataset: Union[FlyteFile, FlyteSchema], name: str, downloads: Optional[Prefetcher] = None
+    ) -> Tuple[str, str]:
+        """
+        Downloads a dataset for the workers to load their shards from, and returns its local path and extension
+        """
+        if downloads is not None and name in downloads:
+            downloads.wait(name)
+        if issubclass(self._dataset_type, FlyteFile):
+            return dataset.download(), dataset.extension()
+        if issubclass(self._dataset_type, FlyteSchema):
+            return dataset.open().from_path, "parquet"
+        raise ValueError("Invalid type for input")
+
+    def execute_dask(
+        self, params: XGBoostParameters, inputs: Dict[str, Any], downloads: Optional[Prefetcher] = None
+    ) -> Tuple[str, str, Dict[str, Dict[str, List[float]]]]:
+        """
+        Trains the model and predicts the test dataset on a local Dask cluster, and returns the model, the predictions
+        and the evaluation result
+        """
+        with local_cluster(self._num_workers, params.hyper_parameters.nthread) as client:
+            # STEP 1
+            # The workers load the partitions of the datasets
+            dtrain = self.load(
+                inputs[self._TRAIN_ARG],
+                self._TRAIN_ARG,
+                params.label_column,
+                downloads=downloads,
+                max_bin=params.hyper_parameters.max_bin,
+                client=client,
+            )
+            dvalid = None
             if self._validate:
-                dvalid = load_flyteschema(valid, params.label_column)
-        else:
-            raise ValueError(f"Invalid type for input")
+                dvalid = self.load(
+                    inputs[self._VALIDATION_ARG],
+                    self._VALIDATION_ARG,
+                    params.label_column,
+                    ref=dtrain,
+                    downloads=downloads,
+                    max_bin=params.hyper_parameters.max_bin,
+                    client=client,
+                )
+
+            # STEP 2
+            model, evals_result = self.train(
+                dtrain=dtrain,
+                dvalid=dvalid,
+                params=params,
+                previous_model=self.previous_model(downloads, **inputs),
+                client=client,
+            )
+            del dtrain, dvalid
+
+            # STEP 3
+            # The predictions are written as the workers finish the partitions of the test dataset
+            test, _ = self.local_dataset(inputs[self._TEST_ARG], self._TEST_ARG, downloads)
+            predictions = predict_partitions(
+                client,
+                MODEL_CACHE.get(model, loader=self.load_model),
+                test,
+                params.label_column,
+                Path(flytekit.current_context().working_directory) / "predictions.npy",
+            )
+        return model, predictions, evals_result
+
+    def previous_model(self, downloads: Optional[Prefetcher] = None, **kwargs) -> Optional[str]:
+        """
+        Returns the local path of the model to continue boosting from, if warm-starting
+        """
+        if not self._warm_start:
+            return None
+        if downloads is not None:
+            downloads.wait(self._PREVIOUS_MODEL_ARG)
+        return kwargs[self._PREVIOUS_MODEL_ARG].download()
 
-        # STEP 2
-        model, evals_result = self.train(dtrain=dtrain, dvalid=dvalid, params=params)
+    def _cache_prefix(self, name: str) -> Optional[str]:
+        if not self._external_memory:
+            return None
+        return str(Path(flytekit.current_context().working_directory) / f"{name}.cache")
 
-        # STEP 3
-        predictions = self.test(booster_model=model, dtest=dtest)
+    def execute(self, **kwargs) -> Any:
+        params: XGBoostParameters = kwargs[self._PARAMS_ARG]
+        test = kwargs[self._TEST_ARG]
+        train = kwargs[self._TRAIN_ARG]
+        if self._validate:
+            valid = kwargs[self._VALIDATION_ARG]
+        downloads = self.prefetch(**kwargs)
+
+        params = self.finalize_params(params)
+        print(f"Finalized parameters = {params}")
 
-        return JoblibSerializedFile(model), predictions, evals_result
+        # XGBoost's OpenMP threads and the BLAS libraries would otherwise size their thread pools from the host
+        with limit_threads(params.hyper_parameters.nthread):
+            if self._dask:
+                model, predictions, evals_result = self.execute_dask(params, kwargs, downloads)
+                return self._MODEL_FORMATS[self._model_format](model), NumpyFile(predictions), evals_result
+
+            if self._num_workers > 1:
+                # STEP 1 and 2
+                # Every worker loads its own shard of the train and validation datasets
+                model, evals_result = self.train_distributed(
+                    train=self.local_dataset(train, self._TRAIN_ARG, downloads),
+                    validation=self.local_dataset(valid, self._VALIDATION_ARG, downloads) if self._validate else None,
+                    params=params,
+                    previous_model=self.previous_model(downloads, **kwargs),
+                )
+                ref = None
+            else:
+                # STEP 1
+                # Only the matrices needed for training are loaded now, the test matrix is loaded once training is
+                # done
+                dtrain = self.load(
+                    train,
+                    self._TRAIN_ARG,
+                    params.label_column,
+                    downloads=downloads,
+                    max_bin=params.hyper_parameters.max_bin,
+                )
+                dvalid = None
+                if self._validate:
+                    dvalid = self.load(
+                        valid,
+                        self._VALIDATION_ARG,
+                        params.label_column,
+                        ref=dtrain,
+                        downloads=downloads,
+                        max_bin=params.hyper_parameters.max_bin,
+                    )
+                previous_model = self.previous_model(downloads, **kwargs)
+
+                # STEP 2
+                model, evals_result = self.train(
+                    dtrain=dtrain, dvalid=dvalid, params=params, previous_model=previous_model
+                )
+                del dvalid
+
+                # The training matrix is freed before the test matrix is loaded, unless the test matrix needs its
+                # quantiles
+                ref = dtrain if self._quantile_dmatrix else None
+                del dtrain
+
+            # STEP 3
+            dtest = self.load(
+                test,
+                self._TEST_ARG,
+                params.label_column,
+                ref=ref,
+                downloads=downloads,
+                max_bin=params.hyper_parameters.max_bin,
+            )
+            del ref
+            predictions = self.test(booster_model=model, dtest=dtest)
+
+            return self._MODEL_FORMATS[self._model_format](model), NumpyFile(predictions), evals_result
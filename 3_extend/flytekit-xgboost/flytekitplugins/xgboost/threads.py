@@ -0,0 +1,107 @@
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Union
+
+from threadpoolctl import threadpool_limits
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# Environment variables the OpenMP and BLAS runtimes size their thread pools from, including in child processes
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "BLIS_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+
+
+def _read_ints(path: str) -> Optional[List[int]]:
+    try:
+        with open(path) as f:
+            return [int(value) for value in f.read().split()]
+    except (OSError, ValueError):
+        return None
+
+
+def cgroup_cpu_quota(root: str = CGROUP_ROOT) -> Optional[float]:
+    """
+    Returns the number of CPUs the container's cgroup CPU quota allows (possibly fractional), or None if there is no
+    quota. Both cgroup v2 (cpu.max) and cgroup v1 (cpu.cfs_quota_us and cpu.cfs_period_us) are supported.
+    """
+    try:
+        with open(os.path.join(root, "cpu.max")) as f:
+            quota, period = f.read().split()[:2]
+        # "max" means that there is no quota
+        return int(quota) / int(period) if quota != "max" else None
+    except (OSError, ValueError):
+        pass
+
+    quota = _read_ints(os.path.join(root, "cpu", "cpu.cfs_quota_us"))
+    period = _read_ints(os.path.join(root, "cpu", "cpu.cfs_period_us"))
+    # A quota of -1 means that there is no quota
+    if not quota or not period or quota[0] <= 0 or period[0] <= 0:
+        return None
+    return quota[0] / period[0]
+
+
+def parse_cpu(cpu: Union[str, int, float]) -> float:
+    """
+    Parses a Kubernetes CPU quantity, as given to flytekit's Resources, e.g. "2", "1.5" or "500m"
+    """
+    if isinstance(cpu, str) and cpu.endswith("m"):
+        return float(cpu[:-1]) / 1000
+    return float(cpu)
+
+
+def available_cpus(cpu: Optional[Union[str, int, float]] = None, cgroup_root: str = CGROUP_ROOT) -> int:
+    """
+    Returns the number of threads to run on: the CPUs the process may be scheduled on, capped by the container's
+    cgroup CPU quota and by the task's CPU resources if given. A fractional number of CPUs is rounded down, since a
+    thread that only gets part of a CPU spends the rest of its time throttled.
+
+    Args:
+        cpu: CPU resources of the task, e.g. "2" or "500m".
+        cgroup_root: Directory the cgroup file system is mounted on.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cpus = float(len(os.sched_getaffinity(0)))
+    else:
+        cpus = float(os.cpu_count() or 1)
+    quota = cgroup_cpu_quota(cgroup_root)
+    if quota is not None:
+        cpus = min(cpus, quota)
+    if cpu is not None:
+        cpus = min(cpus, parse_cpu(cpu))
+    return max(1, math.floor(cpus))
+
+
+@contextmanager
+def limit_threads(nthread: int) -> Iterator[None]:
+    """
+    Limits the OpenMP and BLAS thread pools of the process, and of the processes it starts, to nthread threads.
+    """
+    previous = {name: os.environ.get(name) for name in THREAD_ENV_VARS}
+    os.environ.update({name: str(nthread) for name in THREAD_ENV_VARS})
+    try:
+        # The runtimes that are already loaded only read the environment when they start, so limit them directly
+        with threadpool_limits(limits=nthread):
+            yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def spawn_pool(max_workers: int, **kwargs) -> ProcessPoolExecutor:
+    """
+    Returns a pool of max_workers worker processes. The workers are spawned rather than forked, since XGBoost's
+    OpenMP thread pool is not safe to fork. The other arguments are passed to the ProcessPoolExecutor.
+    """
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"), **kwargs)
@@ -4,7 +4,16 @@ PLUGIN_NAME = "xgboost"
 
 microlib_name = f"flytekitplugins-{PLUGIN_NAME}"
 
-plugin_requires = ["flytekit>=0.25.0b0,<1.0.0", "xgboost>=1.5.0", "scikit-learn>=1.0.1"]
+plugin_requires = [
+    "flytekit>=1.0.0,<2.0.0",
+    "xgboost>=3.0.0",
+    "scikit-learn>=1.0.1",
+    "threadpoolctl>=2.0.0",
+    "numpy",
+    "pandas",
+    "pyarrow>=3.0.0",
+    "scipy",
+]
 
 __version__ = "0.0.0+develop"
 
@@ -17,14 +26,15 @@ setup(
     namespace_packages=["flytekitplugins"],
     packages=[f"flytekitplugins.{PLUGIN_NAME}"],
     install_requires=plugin_requires,
+    extras_require={"dask": ["dask[dataframe]", "distributed"]},
     license="apache2",
-    python_requires=">=3.7",
+    python_requires=">=3.10",
     classifiers=[
         "Intended Audience :: Science/Research",
         "Intended Audience :: Developers",
         "License :: OSI Approved :: Apache Software License",
-        "Programming Language :: Python :: 3.7",
-        "Programming Language :: Python :: 3.8",
+        "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
         "Topic :: Scientific/Engineering",
         "Topic :: Scientific/Engineering :: Artificial Intelligence",
         "Topic :: Software Development",
@@ -0,0 +1,356 @@
+"""
+Benchmarks for the XGBoost plugin. They are not collected by pytest, run them directly:
+
+    python benchmarks.py
+"""
+
+import functools
+import http.server
+import multiprocessing
+import os
+import resource
+import tempfile
+import threading
+import time
+from dataclasses import asdict
+from typing import Any, Callable, List, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+import xgboost
+from flytekit.core.context_manager import FlyteContextManager
+from flytekit.core.type_engine import TypeEngine
+from flytekit.types.file import CSVFile
+
+from flytekitplugins.xgboost import (
+    HyperParameters,
+    ModelParameters,
+    XGBoostParameters,
+    XGBoostTrainerTask,
+    available_cpus,
+    load_booster,
+)
+from flytekitplugins.xgboost.data import quantile_dmatrix, schema_batches
+
+from memory import memory_status, reset_peak_memory
+
+
+def timed(fn: Callable, *args, **kwargs) -> Tuple[float, Any]:
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def synthetic_dmatrix(
+    num_rows: int, num_features: int = 10, seed: int = 0
+) -> xgboost.DMatrix:
+    rng = np.random.default_rng(seed)
+    x = rng.normal(size=(num_rows, num_features)).astype(np.float32)
+    y = x @ rng.normal(size=num_features) + rng.normal(scale=0.1, size=num_rows)
+    return xgboost.DMatrix(x, y)
+
+
+def bench_model_format(num_trees: List[int] = (100, 1_000, 5_000)):
+    """
+    Compares saving and loading a booster with joblib against XGBoost's native UBJSON format.
+    """
+    dtrain = synthetic_dmatrix(10_000)
+    print(
+        f"{'trees':>6} {'format':>7} {'size (KiB)':>11} {'save (s)':>9} {'load (s)':>9}"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in num_trees:
+            booster = xgboost.train(
+                {"max_depth": 6, "verbosity": 0}, dtrain, num_boost_round=n
+            )
+
+            joblib_path = os.path.join(tmp, f"model-{n}.joblib.dat")
+            save, _ = timed(joblib.dump, booster, joblib_path)
+            load, _ = timed(joblib.load, joblib_path)
+            print(
+                f"{n:>6} {'joblib':>7} {os.path.getsize(joblib_path) / 1024:>11.1f}"
+                f" {save:>9.3f} {load:>9.3f}"
+            )
+
+            ubj_path = os.path.join(tmp, f"model-{n}.ubj")
+            save, _ = timed(booster.save_model, ubj_path)
+            load, _ = timed(load_booster, ubj_path)
+            print(
+                f"{n:>6} {'ubj':>7} {os.path.getsize(ubj_path) / 1024:>11.1f}"
+                f" {save:>9.3f} {load:>9.3f}"
+            )
+
+
+def _peak_rss(fn: Callable, *args) -> Tuple[float, float]:
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    elapsed, _ = timed(fn, *args)
+    # ru_maxrss is in KiB on Linux
+    return (
+        elapsed,
+        (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024,
+    )
+
+
+def measured(fn: Callable, *args) -> Tuple[float, float]:
+    """
+    Runs the function in a fresh process and returns its run time and the growth of the process' peak memory (MiB).
+    """
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(_peak_rss, (fn, *args))
+
+
+def load_schema_dataframe(directory: str) -> xgboost.DMatrix:
+    # What load_flyteschema does without quantile: read every file, drop the label, copy to an array
+    df = pd.read_parquet(directory)
+    target = df[df.columns[0]]
+    df = df.drop(df.columns[0], axis=1)
+    return xgboost.DMatrix(df.values, target.values)
+
+
+def load_schema_quantile(directory: str) -> xgboost.DMatrix:
+    return quantile_dmatrix(schema_batches(directory, 0))
+
+
+def bench_schema_loader(
+    num_rows: List[int] = (1_000_000, 5_000_000), num_features: int = 20
+):
+    """
+    Compares loading a FlyteSchema as a whole DataFrame against streaming its row groups into a QuantileDMatrix.
+    The QuantileDMatrix sketches the feature quantiles while loading, which a DMatrix leaves to the first boosting
+    round with the hist tree method, so its load time includes work that training would do anyway.
+    """
+    print(f"{'rows':>10} {'loader':>10} {'time (s)':>9} {'peak (MiB)':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in num_rows:
+            directory = os.path.join(tmp, f"schema-{n}")
+            os.makedirs(directory)
+            rng = np.random.default_rng(0)
+            for i, start in enumerate(range(0, n, 1_000_000)):
+                rows = min(1_000_000, n - start)
+                data = rng.normal(size=(rows, num_features + 1)).astype(np.float32)
+                pd.DataFrame(
+                    data, columns=[str(c) for c in range(num_features + 1)]
+                ).to_parquet(
+                    os.path.join(directory, f"{i:05d}"), row_group_size=100_000
+                )
+            for name, loader in [
+                ("dataframe", load_schema_dataframe),
+                ("quantile", load_schema_quantile),
+            ]:
+                elapsed, peak = measured(loader, directory)
+                print(f"{n:>10} {name:>10} {elapsed:>9.3f} {peak:>11.1f}")
+
+
+class SlowLinkHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    Serves files over a simulated slow link: every response waits for the latency, then is sent at the bandwidth.
+    """
+
+    latency = 0.2
+    bandwidth = 20 * 2**20
+
+    def copyfile(self, source, outputfile):
+        time.sleep(self.latency)
+        while True:
+            chunk = source.read(64 * 1024)
+            if not chunk:
+                return
+            try:
+                outputfile.write(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client only wanted the headers
+                return
+            time.sleep(len(chunk) / self.bandwidth)
+
+    def log_message(self, *args):
+        pass
+
+
+def remote_csv(url: str) -> CSVFile:
+    # Converts the URL the way flytekit passes a task input, so that the file is downloaded when the task asks for it
+    ctx = FlyteContextManager.current_context()
+    literal = TypeEngine.to_literal(
+        ctx, url, CSVFile, TypeEngine.to_literal_type(CSVFile)
+    )
+    return TypeEngine.to_python_value(ctx, literal, CSVFile)
+
+
+def bench_prefetch(
+    num_rows: int = 200_000,
+    num_features: int = 20,
+    bandwidths: List[int] = (5, 20, 100),
+):
+    """
+    Compares downloading the train, validation and test files one after another against prefetching them, from a
+    local HTTP server that simulates links of different bandwidths (MiB/s).
+    """
+    config = XGBoostParameters(
+        hyper_parameters=HyperParameters(verbosity=0, tree_method="hist"),
+        model_parameters=ModelParameters(num_boost_round=10, verbose_eval=False),
+    )
+    trainers = {
+        prefetch: XGBoostTrainerTask(
+            name=f"bench-prefetch-{prefetch}",
+            config=config,
+            dataset_type=CSVFile,
+            validate=True,
+            prefetch=prefetch,
+        )
+        for prefetch in (False, True)
+    }
+    print(f"{'MiB/s':>6} {'sequential (s)':>15} {'prefetch (s)':>13}")
+    with tempfile.TemporaryDirectory() as tmp:
+        rng = np.random.default_rng(0)
+        for name in ("train", "validation", "test"):
+            data = rng.normal(size=(num_rows, num_features + 1)).astype(np.float32)
+            pd.DataFrame(data).to_csv(
+                os.path.join(tmp, f"{name}.csv"), header=False, index=False
+            )
+
+        server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), functools.partial(SlowLinkHandler, directory=tmp)
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            for bandwidth in bandwidths:
+                SlowLinkHandler.bandwidth = bandwidth * 2**20
+                times = {}
+                for prefetch, trainer in trainers.items():
+                    inputs = {
+                        name: remote_csv(
+                            f"http://127.0.0.1:{server.server_port}/{name}.csv"
+                        )
+                        for name in ("train", "validation", "test")
+                    }
+                    times[prefetch], _ = timed(
+                        trainer.execute, params=XGBoostParameters(), **inputs
+                    )
+                print(f"{bandwidth:>6} {times[False]:>15.3f} {times[True]:>13.3f}")
+        finally:
+            server.shutdown()
+
+
+def _train_throughput(
+    cores: int, nthread: str, num_rows: int, num_boost_round: int
+) -> float:
+    # Pin the process to the first cores, like a container limited to them
+    os.sched_setaffinity(0, sorted(os.sched_getaffinity(0))[:cores])
+    threads = available_cpus() if nthread == "available" else os.cpu_count()
+    dtrain = synthetic_dmatrix(num_rows, num_features=20)
+    elapsed, _ = timed(
+        xgboost.train,
+        {"tree_method": "hist", "nthread": threads, "verbosity": 0},
+        dtrain,
+        num_boost_round=num_boost_round,
+    )
+    return num_rows * num_boost_round / elapsed
+
+
+def bench_threads(
+    cores: List[int] = (1, 2, 4, 8),
+    num_rows: int = 1_000_000,
+    num_boost_round: int = 20,
+):
+    """
+    Compares the training throughput (rows x rounds per second) on 1, 2, 4 and 8 cores, with as many threads as
+    available_cpus() returns against as many threads as the host has cores, which is what a task gets when its
+    container is limited by a CPU quota that XGBoost doesn't see. Core counts beyond the host's are skipped.
+    """
+    host_cores = len(os.sched_getaffinity(0))
+    print(
+        f"{'cores':>6} {'host threads':>13} {'host (rows/s)':>14} {'available (rows/s)':>19}"
+    )
+    for n in cores:
+        if n > host_cores:
+            print(f"{n:>6} {'-':>13} {'-':>14} {'-':>19}")
+            continue
+        throughput = {}
+        for nthread in ("host", "available"):
+            # A fresh process per run, so that the OpenMP thread pool is sized for it
+            with multiprocessing.get_context("spawn").Pool(1) as pool:
+                throughput[nthread] = pool.apply(
+                    _train_throughput, (n, nthread, num_rows, num_boost_round)
+                )
+        print(
+            f"{n:>6} {os.cpu_count():>13} {throughput['host']:>14.0f}"
+            f" {throughput['available']:>19.0f}"
+        )
+
+
+def _fit_synthetic(
+    num_rows: int,
+    hyper_parameters: HyperParameters,
+    num_boost_round: int,
+    num_features: int = 20,
+) -> Tuple[float, float, float]:
+    rng = np.random.default_rng(0)
+
+    def make(n: int) -> xgboost.DMatrix:
+        x = rng.normal(size=(n, num_features)).astype(np.float32)
+        # A non-linear target, so that the tree methods' split candidates matter
+        y = np.sin(2 * x[:, 0]) + x[:, 1] * x[:, 2] + np.abs(x[:, 3])
+        return xgboost.DMatrix(x, y + rng.normal(scale=0.1, size=n))
+
+    dtrain, dvalid = make(num_rows), make(100_000)
+    # Only the memory used to train is measured
+    reset_peak_memory()
+    baseline = memory_status("VmRSS")
+    evals_result = {}
+    elapsed, _ = timed(
+        xgboost.train,
+        {**asdict(hyper_parameters), "eval_metric": "rmse"},
+        dtrain,
+        num_boost_round=num_boost_round,
+        evals=[(dvalid, "validation")],
+        evals_result=evals_result,
+        verbose_eval=False,
+    )
+    peak = memory_status("VmHWM") - baseline
+    return elapsed, peak, evals_result["validation"]["rmse"][-1]
+
+
+def bench_tree_method(
+    num_rows: List[int] = (1_000_000, 5_000_000, 10_000_000),
+    num_boost_round: int = 20,
+    max_exact_rows: int = 10_000_000,
+):
+    """
+    Compares the tree methods, and the max_bin and grow_policy settings of the histogram method, on synthetic data:
+    training time, peak memory used to train on top of the loaded matrices, and validation RMSE. Every run is done in
+    a fresh process. The exact method is only run up to max_exact_rows rows, since it is much slower beyond that.
+    """
+    settings = {
+        "exact": HyperParameters(verbosity=0, tree_method="exact"),
+        "approx": HyperParameters(verbosity=0, tree_method="approx"),
+        "hist": HyperParameters(verbosity=0, tree_method="hist"),
+        "hist/64 bins": HyperParameters(verbosity=0, tree_method="hist", max_bin=64),
+        "hist/lossguide": HyperParameters(
+            verbosity=0,
+            tree_method="hist",
+            grow_policy="lossguide",
+            max_depth=0,
+            max_leaves=63,
+        ),
+    }
+    print(
+        f"{'rows':>10} {'setting':>15} {'time (s)':>9} {'peak (MiB)':>11} {'rmse':>7}"
+    )
+    for n in num_rows:
+        for name, hyper_parameters in settings.items():
+            if hyper_parameters.tree_method == "exact" and n > max_exact_rows:
+                print(f"{n:>10} {name:>15} {'-':>9} {'-':>11} {'-':>7}")
+                continue
+            with multiprocessing.get_context("spawn").Pool(1) as pool:
+                elapsed, peak, rmse = pool.apply(
+                    _fit_synthetic, (n, hyper_parameters, num_boost_round)
+                )
+            print(f"{n:>10} {name:>15} {elapsed:>9.3f} {peak:>11.1f} {rmse:>7.4f}")
+
+
+if __name__ == "__main__":
+    bench_model_format()
+    bench_schema_loader()
+    bench_prefetch()
+    bench_threads()
+    bench_tree_method()
@@ -0,0 +1,17 @@
+def memory_status(field: str) -> float:
+    """
+    Returns a memory field of /proc/self/status, such as VmRSS or VmHWM, in MiB
+    """
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(f"{field}:"):
+                # The sizes are in KiB
+                return int(line.split()[1]) / 1024
+
+
+def reset_peak_memory():
+    """
+    Resets the peak RSS of the process (VmHWM) to its current RSS
+    """
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
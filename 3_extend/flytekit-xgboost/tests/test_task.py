@@ -1,9 +1,16 @@
+import multiprocessing
 import os
+import sys
+import threading
+import time
+import typing
 from typing import Dict, List, NamedTuple, Tuple
 
 import flytekit
+import joblib
 import numpy as np
 import pandas as pd
+import pytest
 import xgboost
 from flytekit import kwtypes, task, workflow
 from flytekit.types.file import CSVFile, FlyteFile, JoblibSerializedFile
@@ -11,11 +18,32 @@ from flytekit.types.schema import FlyteSchema
 from sklearn import model_selection
 
 from flytekitplugins.xgboost import (
+    DMATRIX_CACHE,
+    DMatrixCache,
     HyperParameters,
+    ModelCache,
     ModelParameters,
+    NumpyFile,
+    Trial,
+    XGBoostModelFile,
     XGBoostParameters,
+    XGBoostSearchTask,
     XGBoostTrainerTask,
+    available_cpus,
+    load_booster,
+    model_lineage,
 )
+from flytekitplugins.xgboost.cache import file_digest
+from flytekitplugins.xgboost.dask_training import read_parquet
+from flytekitplugins.xgboost.data import (
+    Prefetcher,
+    batches_dmatrix,
+    external_memory_dmatrix,
+    shard_batches,
+)
+from flytekitplugins.xgboost.threads import limit_threads
+
+from .memory import memory_status, reset_peak_memory
 
 
 def test_simple_model():
@@ -34,7 +62,7 @@ def test_simple_model():
     def train_test_wf(
         train: FlyteFile = "https://raw.githubusercontent.com/dmlc/xgboost/master/demo/data/agaricus.txt.train",
         test: FlyteFile = "https://raw.githubusercontent.com/dmlc/xgboost/master/demo/data/agaricus.txt.test",
-    ) -> List[float]:
+    ) -> NumpyFile:
         _, predictions, _ = xgboost_trainer(
             train=train,
             test=test,
@@ -109,7 +137,7 @@ def test_csv_data():
     wf_output = NamedTuple(
         "wf_output",
         model=JoblibSerializedFile,
-        predictions=List[float],
+        predictions=NumpyFile,
         evaluation_result=Dict[str, Dict[str, List[float]]],
     )
 
@@ -162,7 +190,7 @@ def test_local_data():
     def wf(
         train_data: CSVFile = "abalone_train.csv",
         test_data: CSVFile = "abalone_test.csv",
-    ) -> List[float]:
+    ) -> NumpyFile:
         _, predictions, _ = xgboost_trainer(
             train=train_data,
             test=test_data,
@@ -207,7 +235,7 @@ def test_schema_data():
     @workflow
     def wf(
         train_data: str = "abalone_train.csv", test_data: str = "abalone_test.csv"
-    ) -> List[float]:
+    ) -> NumpyFile:
         _, predictions, _ = xgboost_trainer(
             train=csv_to_df(data=train_data),
             test=csv_to_df(data=test_data),
@@ -236,13 +264,12 @@ def test_pipeline():
     )
 
     @task
-    def estimate_accuracy(predictions: List[float], test: FlyteFile) -> float:
+    def estimate_accuracy(predictions: NumpyFile, test: FlyteFile) -> float:
         test.download()
-        dtest = xgboost.DMatrix(test.path)
+        dtest = xgboost.DMatrix(f"{test.path}?format=libsvm")
         labels = dtest.get_label()
-        return sum(
-            1 for i in range(len(predictions)) if int(predictions[i] > 0.5) == labels[i]
-        ) / float(len(predictions))
+        y_pred = np.load(predictions)
+        return float(np.mean((y_pred > 0.5) == labels))
 
     wf_output = NamedTuple(
         "wf_output",
@@ -278,3 +305,833 @@ def test_pipeline():
         "params": XGBoostParameters,
     }
     assert full_pipeline().accuracy >= 0.7
+
+
+def test_model_cache(tmp_path):
+    rng = np.random.default_rng(0)
+    dtrain = xgboost.DMatrix(rng.normal(size=(100, 4)), rng.normal(size=100))
+    paths = []
+    for i, num_boost_round in enumerate([1, 1, 2]):
+        booster = xgboost.train(
+            {"verbosity": 0}, dtrain, num_boost_round=num_boost_round
+        )
+        paths.append(tmp_path / f"model-{i}.joblib.dat")
+        joblib.dump(booster, paths[-1])
+
+    cache = ModelCache(max_size=1)
+    first = cache.get(paths[0])
+    # The second file has the same content, so it is served from the cache
+    assert cache.get(paths[1]) is first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Loading a different model evicts the first one
+    cache.get(paths[2])
+    assert len(cache) == 1
+    assert cache.get(paths[0]) is not first
+    assert (cache.hits, cache.misses) == (1, 3)
+
+    cache.invalidate(paths[0])
+    assert len(cache) == 0
+    cache.get(paths[0])
+    cache.invalidate()
+    assert len(cache) == 0
+    assert cache.misses == 4
+
+
+def test_native_model_format():
+    config = XGBoostParameters(
+        hyper_parameters=HyperParameters(max_depth=5, verbosity=0),
+        label_column=0,
+    )
+    joblib_trainer = XGBoostTrainerTask(
+        name="test6", config=config, dataset_type=CSVFile
+    )
+    ubj_trainer = XGBoostTrainerTask(
+        name="test7", config=config, dataset_type=CSVFile, model_format="ubj"
+    )
+
+    assert ubj_trainer.python_interface.outputs["model"] == XGBoostModelFile
+
+    def train(trainer):
+        return trainer(
+            train="abalone_train.csv",
+            test="abalone_test.csv",
+            params=XGBoostParameters(),
+        )
+
+    _, joblib_predictions, _ = train(joblib_trainer)
+    model, ubj_predictions, _ = train(ubj_trainer)
+    joblib_predictions = np.load(joblib_predictions)
+    ubj_predictions = np.load(ubj_predictions)
+    assert ubj_predictions.dtype == np.float32
+    assert np.allclose(joblib_predictions, ubj_predictions)
+
+    # The booster can be loaded from a file or from a memory buffer
+    with open(model.download(), "rb") as f:
+        buffer = f.read()
+    dtest = xgboost.DMatrix("abalone_test.csv?format=csv&label_column=0")
+    for source in (model.path, buffer):
+        assert np.allclose(load_booster(source).predict(dtest), ubj_predictions)
+
+    with pytest.raises(ValueError):
+        XGBoostTrainerTask(name="test8", config=config, model_format="pickle")
+
+
+@pytest.mark.parametrize("model_format", ["joblib", "ubj"])
+def test_warm_start(model_format):
+    config = XGBoostParameters(
+        hyper_parameters=HyperParameters(max_depth=5, verbosity=0),
+        model_parameters=ModelParameters(num_boost_round=3),
+        label_column=0,
+    )
+    trainer = XGBoostTrainerTask(
+        name=f"test9-{model_format}",
+        config=config,
+        dataset_type=CSVFile,
+        model_format=model_format,
+    )
+    warm_trainer = XGBoostTrainerTask(
+        name=f"test10-{model_format}",
+        config=config,
+        dataset_type=CSVFile,
+        model_format=model_format,
+        warm_start=True,
+    )
+
+    assert warm_trainer.python_interface.inputs["previous_model"] == (
+        trainer.python_interface.outputs["model"]
+    )
+
+    def load(model):
+        if model_format == "ubj":
+            return load_booster(model.download())
+        return joblib.load(model.download())
+
+    parent, _, _ = trainer(
+        train="abalone_train.csv", test="abalone_test.csv", params=XGBoostParameters()
+    )
+    child, _, _ = warm_trainer(
+        train="abalone_train.csv",
+        test="abalone_test.csv",
+        previous_model=parent,
+        params=XGBoostParameters(),
+    )
+    grandchild, _, _ = warm_trainer(
+        train="abalone_train.csv",
+        test="abalone_test.csv",
+        previous_model=child,
+        params=XGBoostParameters(),
+    )
+
+    # Every warm start boosts num_boost_round more rounds on top of the previous model
+    assert load(parent).num_boosted_rounds() == 3
+    assert load(child).num_boosted_rounds() == 6
+    assert load(grandchild).num_boosted_rounds() == 9
+
+    assert model_lineage(load(parent)) == []
+    assert model_lineage(load(child)) == [file_digest(parent.download())]
+    assert model_lineage(load(grandchild)) == [
+        file_digest(parent.download()),
+        file_digest(child.download()),
+    ]
+
+
+def test_external_memory(tmp_path):
+    config = XGBoostParameters(
+        hyper_parameters=HyperParameters(max_depth=5, verbosity=0, tree_method="hist"),
+        label_column=0,
+    )
+    in_memory_trainer = XGBoostTrainerTask(
+        name="test11", config=config, dataset_type=CSVFile
+    )
+    external_memory_trainer = XGBoostTrainerTask(
+        name="test12", config=config, dataset_type=CSVFile, external_memory=True
+    )
+
+    def train(trainer):
+        _, predictions, _ = trainer(
+            train="abalone_train.csv",
+            test="abalone_test.csv",
+            params=XGBoostParameters(),
+        )
+        return np.load(predictions)
+
+    assert np.allclose(
+        train(in_memory_trainer), train(external_memory_trainer), rtol=1e-3
+    )
+
+    # Every format is streamed in batches into the same matrix as the one loaded in memory
+    data = pd.read_csv("abalone_train.csv", header=None)
+    data.columns = [str(c) for c in data.columns]
+    data.to_parquet(tmp_path / "abalone_train.parquet")
+    with open(tmp_path / "abalone_train.libsvm", "w") as f:
+        for row in data.to_numpy():
+            features = " ".join(f"{i}:{v}" for i, v in enumerate(row[1:], 1) if v)
+            f.write(f"{row[0]} {features}\n")
+
+    expected = xgboost.DMatrix(data.iloc[:, 1:].to_numpy(), data.iloc[:, 0].to_numpy())
+    for extension, path in [
+        ("csv", "abalone_train.csv"),
+        ("parquet", tmp_path / "abalone_train.parquet"),
+        ("libsvm", tmp_path / "abalone_train.libsvm"),
+    ]:
+        dmatrix = external_memory_dmatrix(
+            path, extension, 0, str(tmp_path / f"{extension}.cache"), batch_size=500
+        )
+        assert dmatrix.num_row() == expected.num_row()
+        assert np.allclose(dmatrix.get_label(), expected.get_label())
+
+
+def test_quantile_dmatrix():
+    config = XGBoostParameters(
+        hyper_parameters=HyperParameters(max_depth=5, verbosity=0, tree_method="hist"),
+        label_column=0,
+    )
+    dataframe_trainer = XGBoostTrainerTask(
+        name="test13", config=config, dataset_type=FlyteSchema
+    )
+    quantile_trainer = XGBoostTrainerTask(
+        name="test14",
+        config=config,
+        dataset_type=FlyteSchema,
+        quantile_dmatrix=True,
+    )
+
+    @task
+    def csv_to_df(data: str) -> pd.DataFrame:
+        return pd.read_csv(data, header=None, names=[str(i) for i in range(11)])
+
+    def train(trainer, params=XGBoostParameters()):
+        @workflow
+        def wf() -> NumpyFile:
+            train_data = csv_to_df(data="abalone_train.csv")
+            test_data = csv_to_df(data="abalone_test.csv")
+            _, predictions, _ = trainer(
+                train=train_data,
+                test=test_data,
+                params=params,
+            )
+            return predictions
+
+        return np.load(wf())
+
+    assert np.allclose(train(dataframe_trainer), train(quantile_trainer), rtol=1e-3)
+
+    # The QuantileDMatrix is built with the number of bins the model is trained with
+    params = XGBoostParameters(
+        hyper_parameters=HyperParameters(
+            max_depth=5, verbosity=0, tree_method="hist", max_bin=16
+        )
+    )
+    assert np.allclose(
+        train(dataframe_trainer, params), train(quantile_trainer, params), rtol=1e-3
+    )
+    assert not np.allclose(train(quantile_trainer), train(quantile_trainer, params))
+
+
+def test_tree_method():
+    with pytest.raises(ValueError):
+        HyperParameters(tree_method="gpu_exact")
+    with pytest.raises(ValueError):
+        HyperParameters(grow_policy="breadthwise")
+    with pytest.raises(ValueError):
+        HyperParameters(sampling_method="random")
+    with pytest.raises(ValueError):
+        HyperParameters(max_bin=1)
+    with pytest.raises(ValueError):
+        HyperParameters(max_leaves=-1)
+    with pytest.raises(ValueError):
+        HyperParameters(tree_method="exact", grow_policy="lossguide")
+    with pytest.raises(ValueError):
+        HyperParameters(tree_method="approx", sampling_method="gradient_based")
+    # The parameters are validated when they are passed to a task too
+    with pytest.raises(ValueError):
+        HyperParameters.from_dict({"tree_method": "gpu_exact"})
+
+    xgboost_trainer = XGBoostTrainerTask(
+        name="test22",
+        config=XGBoostParameters(
+            model_parameters=ModelParameters(num_boost_round=5, verbose_eval=False),
+        ),
+        dataset_type=CSVFile,
+    )
+
+    def leaves(hyper_parameters: HyperParameters) -> List[int]:
+        model, _, _ = xgboost_trainer.execute(
+            train=CSVFile("abalone_train.csv"),
+            test=CSVFile("abalone_test.csv"),
+            params=XGBoostParameters(hyper_parameters=hyper_parameters),
+        )
+        trees = joblib.load(model).get_dump()
+        return [tree.count("leaf=") for tree in trees]
+
+    for tree_method in ["exact", "approx", "hist"]:
+        assert len(leaves(HyperParameters(verbosity=0, tree_method=tree_method))) == 5
+    assert max(leaves(HyperParameters(verbosity=0, max_depth=8))) > 7
+    # Gradient-based sampling runs on the CPU "hist" tree method
+    for tree_method in ["auto", "hist"]:
+        hyper_parameters = HyperParameters(
+            verbosity=0,
+            tree_method=tree_method,
+            subsample=0.5,
+            sampling_method="gradient_based",
+        )
+        assert len(leaves(hyper_parameters)) == 5
+    assert (
+        max(
+            leaves(
+                HyperParameters(
+                    verbosity=0,
+                    tree_method="hist",
+                    max_depth=8,
+                    grow_policy="lossguide",
+                    max_leaves=7,
+                    max_bin=32,
+                )
+            )
+        )
+        <= 7
+    )
+
+
+def _peak_rss_growth(fn, *args) -> float:
+    reset_peak_memory()
+    baseline = memory_status("VmRSS")
+    fn(*args)
+    return memory_status("VmHWM") - baseline
+
+
+def _load_csv(path: str):
+    xgboost.DMatrix(f"{path}?format=csv&label_column=0")
+
+
+def _train_and_test(train: str, validation: str, test: str):
+    trainer = XGBoostTrainerTask(
+        name="test15",
+        config=XGBoostParameters(
+            hyper_parameters=HyperParameters(
+                max_depth=2, verbosity=0, tree_method="hist"
+            ),
+            model_parameters=ModelParameters(num_boost_round=1, verbose_eval=False),
+        ),
+        dataset_type=CSVFile,
+        validate=True,
+    )
+    trainer.execute(
+        train=CSVFile(train),
+        validation=CSVFile(validation),
+        test=CSVFile(test),
+        params=XGBoostParameters(),
+    )
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="relies on glibc's malloc")
+def test_lazy_loading(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    paths = []
+    for name, num_rows in [
+        ("train", 100_000),
+        ("validation", 100_000),
+        ("test", 200_000),
+    ]:
+        paths.append(str(tmp_path / f"{name}.csv"))
+        data = rng.normal(size=(num_rows, 41)).astype(np.float32)
+        pd.DataFrame(data).to_csv(paths[-1], header=False, index=False)
+
+    # Make malloc return freed matrices to the OS, so that freeing them shows in the RSS
+    monkeypatch.setenv("MALLOC_MMAP_THRESHOLD_", "131072")
+    monkeypatch.setenv("MALLOC_TRIM_THRESHOLD_", "131072")
+
+    def measure(fn, *args) -> float:
+        # Every measurement runs in a fresh process, started with the malloc settings
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            return pool.apply(_peak_rss_growth, (fn, *args))
+
+    # Loading the test data costs about as much as loading the train and validation data together. The test
+    # matrix is only loaded after training, once the train and validation matrices are freed.
+    train_size, validation_size = (measure(_load_csv, path) for path in paths[:2])
+    assert measure(_train_and_test, *paths) < train_size + validation_size
+
+
+def test_prefetcher():
+    class SlowFile(object):
+        def __init__(self, path: str, error: bool = False):
+            self.path = path
+            self.error = error
+            self.started = threading.Event()
+
+        def download(self) -> str:
+            self.started.set()
+            time.sleep(0.5)
+            if self.error:
+                raise IOError(f"Failed to download {self.path}")
+            return self.path
+
+    files = {name: SlowFile(f"{name}.csv") for name in ("train", "validation", "test")}
+    files["model"] = SlowFile("model.ubj", error=True)
+
+    start = time.perf_counter()
+    downloads = Prefetcher(files)
+    # All the downloads start right away
+    assert all(f.started.wait(timeout=0.4) for f in files.values())
+    assert downloads.wait("train") == "train.csv"
+    assert downloads.wait("test") == "test.csv"
+    assert time.perf_counter() - start < 1.0
+
+    assert "validation" in downloads and "previous_model" not in downloads
+    with pytest.raises(IOError):
+        downloads.wait("model")
+
+
+def test_dmatrix_cache(tmp_path):
+    data = pd.read_csv("abalone_train.csv", header=None)
+    paths = []
+    for i in range(2):
+        paths.append(str(tmp_path / f"train-{i}.csv"))
+        data.iloc[i * 1000 : (i + 1) * 1000].to_csv(
+            paths[-1], header=False, index=False
+        )
+
+    def parse(path, label_column=0):
+        return lambda: xgboost.DMatrix(f"{path}?format=csv&label_column={label_column}")
+
+    def not_parsed():
+        raise AssertionError("The dataset should be loaded from the cache")
+
+    cache = DMatrixCache(tmp_path / "cache")
+    first = cache.get(paths[0], 0, "csv", loader=parse(paths[0]))
+    cached = cache.get(paths[0], 0, "csv", loader=not_parsed)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert np.allclose(first.get_label(), cached.get_label())
+    assert cached.num_col() == first.num_col()
+
+    # The same file parsed with another label column is another dataset
+    cache.get(paths[0], 1, "csv", loader=parse(paths[0], label_column=1))
+    assert cache.misses == 2
+
+    # Once the cache is full, the least recently used datasets are evicted
+    entry_size = cache.size() // 2
+    cache = DMatrixCache(tmp_path / "cache", max_bytes=int(entry_size * 2.5))
+    cache.get(paths[0], 0, "csv", loader=not_parsed)
+    cache.get(paths[1], 0, "csv", loader=parse(paths[1]))
+    cache.get(paths[0], 0, "csv", loader=not_parsed)
+    cache.get(paths[1], 0, "csv", loader=not_parsed)
+    assert cache.size() <= entry_size * 2.5
+    cache.clear()
+    assert cache.size() == 0
+
+    # Repeated runs of the task on the same files skip parsing them
+    trainer = XGBoostTrainerTask(
+        name="test16",
+        config=XGBoostParameters(hyper_parameters=HyperParameters(verbosity=0)),
+        dataset_type=CSVFile,
+        cache_dmatrix=True,
+    )
+    DMATRIX_CACHE.clear()
+    DMATRIX_CACHE.reset_stats()
+    predictions = []
+    for _ in range(2):
+        _, _predictions, _ = trainer(
+            train="abalone_train.csv",
+            test="abalone_test.csv",
+            params=XGBoostParameters(),
+        )
+        predictions.append(np.load(_predictions))
+    assert (DMATRIX_CACHE.hits, DMATRIX_CACHE.misses) == (2, 2)
+    assert np.allclose(*predictions)
+
+
+def test_libsvm_data(tmp_path):
+    # Convert the abalone CSV files to libsvm, with 0-based feature indices
+    paths = {}
+    for name in ["train", "test"]:
+        data = pd.read_csv(f"abalone_{name}.csv", header=None).to_numpy()
+        paths[name] = str(tmp_path / f"abalone_{name}.libsvm")
+        with open(paths[name], "w") as f:
+            for row in data:
+                features = " ".join(f"{i}:{value}" for i, value in enumerate(row[1:]))
+                f.write(f"{row[0]} {features}\n")
+
+    LibSVMFile = FlyteFile[typing.TypeVar("libsvm")]
+    config = XGBoostParameters(
+        hyper_parameters=HyperParameters(max_depth=4, verbosity=0),
+        model_parameters=ModelParameters(num_boost_round=5, verbose_eval=False),
+    )
+    csv_trainer = XGBoostTrainerTask(name="test29", config=config, dataset_type=CSVFile)
+    _, expected, _ = csv_trainer.execute(
+        train=CSVFile("abalone_train.csv"),
+        test=CSVFile("abalone_test.csv"),
+        params=XGBoostParameters(),
+    )
+
+    DMATRIX_CACHE.clear()
+    DMATRIX_CACHE.reset_stats()
+    for cache_dmatrix in [False, True, True]:
+        trainer = XGBoostTrainerTask(
+            name=f"test30-{cache_dmatrix}",
+            config=config,
+            dataset_type=LibSVMFile,
+            cache_dmatrix=cache_dmatrix,
+        )
+        _, predictions, _ = trainer.execute(
+            train=LibSVMFile(paths["train"]),
+            test=LibSVMFile(paths["test"]),
+            params=XGBoostParameters(),
+        )
+        assert np.allclose(np.load(predictions), np.load(expected), rtol=1e-5)
+    assert (DMATRIX_CACHE.hits, DMATRIX_CACHE.misses) == (2, 2)
+
+
+def test_evaluation_result_output():
+    trainer = XGBoostTrainerTask(
+        name="test32",
+        config=XGBoostParameters(
+            hyper_parameters=HyperParameters(max_depth=2, verbosity=0),
+            model_parameters=ModelParameters(num_boost_round=3, verbose_eval=False),
+        ),
+        dataset_type=CSVFile,
+        validate=True,
+    )
+
+    @task
+    def last_score(evaluation_result: Dict[str, Dict[str, List[float]]]) -> float:
+        return evaluation_result["validation"]["rmse"][-1]
+
+    # The evaluation history is bound to workflow outputs and task inputs like any other Dict
+    @workflow
+    def evaluate_wf(
+        train: CSVFile, validation: CSVFile, test: CSVFile
+    ) -> Tuple[Dict[str, Dict[str, List[float]]], float]:
+        _, _, evaluation_result = trainer(
+            train=train, validation=validation, test=test, params=XGBoostParameters()
+        )
+        return evaluation_result, last_score(evaluation_result=evaluation_result)
+
+    evaluation_result, score = evaluate_wf(
+        train=CSVFile("abalone_train.csv"),
+        validation=CSVFile("abalone_test.csv"),
+        test=CSVFile("abalone_test.csv"),
+    )
+    assert len(evaluation_result["validation"]["rmse"]) == 3
+    assert score == evaluation_result["validation"]["rmse"][-1]
+
+
+def test_hyperparameter_search():
+    config = XGBoostParameters(
+        hyper_parameters=HyperParameters(verbosity=0),
+        model_parameters=ModelParameters(num_boost_round=9),
+        label_column=0,
+    )
+    search = XGBoostSearchTask(
+        name="test17",
+        search_space={"max_depth": [2, 4, 6], "eta": [0.1, 0.3, 1.0]},
+        config=config,
+        dataset_type=CSVFile,
+        max_workers=2,
+        successive_halving=True,
+        min_boost_round=1,
+        reduction_factor=3,
+        model_format="ubj",
+    )
+    assert search.python_interface.outputs["leaderboard"] == List[Trial]
+
+    model, predictions, leaderboard = search(
+        train="abalone_train.csv",
+        validation="abalone_test.csv",
+        test="abalone_test.csv",
+        params=XGBoostParameters(),
+    )
+
+    # 9 trials get 1 round, the best 3 get 3 rounds, and the best one gets all 9 rounds
+    assert len(leaderboard) == 9
+    assert [trial.num_boost_round for trial in leaderboard] == [9, 3, 3] + [1] * 6
+    assert leaderboard[1].score <= leaderboard[2].score
+    assert all(trial.metric == "rmse" for trial in leaderboard)
+    assert sorted(trial.trial for trial in leaderboard) == list(range(9))
+
+    # The best model is the one that was trained the longest
+    booster = load_booster(model.download())
+    assert booster.num_boosted_rounds() == 9
+    dtest = xgboost.DMatrix("abalone_test.csv?format=csv&label_column=0")
+    assert np.allclose(booster.predict(dtest), np.load(predictions))
+    assert booster.predict(dtest).shape == (dtest.num_row(),)
+
+    # 4 trials get 1 round, the best 2 get 2 rounds, and the last one left is trained up to all 16 rounds
+    uneven_search = XGBoostSearchTask(
+        name="test31",
+        search_space={"max_depth": [2, 4], "eta": [0.3, 1.0]},
+        config=XGBoostParameters(
+            hyper_parameters=HyperParameters(verbosity=0),
+            model_parameters=ModelParameters(num_boost_round=16),
+            label_column=0,
+        ),
+        dataset_type=CSVFile,
+        max_workers=2,
+        successive_halving=True,
+        min_boost_round=1,
+        reduction_factor=2,
+        model_format="ubj",
+    )
+    model, _, leaderboard = uneven_search(
+        train="abalone_train.csv",
+        validation="abalone_test.csv",
+        test="abalone_test.csv",
+        params=XGBoostParameters(),
+    )
+    assert [trial.num_boost_round for trial in leaderboard] == [16, 2, 1, 1]
+    assert load_booster(model.download()).num_boosted_rounds() == 16
+
+    random_search = XGBoostSearchTask(
+        name="test18",
+        search_space={"max_depth": (2, 8), "subsample": (0.5, 1.0)},
+        config=config,
+        strategy="random",
+        num_trials=4,
+        seed=0,
+    )
+    trials = random_search.configurations()
+    assert len(trials) == 4 and trials == random_search.configurations()
+    assert all(isinstance(trial["max_depth"], int) for trial in trials)
+
+    with pytest.raises(ValueError):
+        XGBoostSearchTask(name="test19", search_space={"depth": [1, 2]})
+    with pytest.raises(ValueError):
+        XGBoostSearchTask(name="test20", search_space={"max_depth": (2, 8)})
+
+
+def test_search_metric_direction():
+    sort_key = XGBoostSearchTask._sort_key
+    # "mape" is minimized, even though its name starts with the maximized "map"
+    assert sort_key("mape", 0.1) < sort_key("mape", 0.5)
+    assert sort_key("rmse", 0.1) < sort_key("rmse", 0.5)
+    assert sort_key("map", 0.5) < sort_key("map", 0.1)
+    assert sort_key("ndcg@10", 0.5) < sort_key("ndcg@10", 0.1)
+    assert sort_key("auc", 0.9) < sort_key("auc", 0.6)
+
+
+def test_available_cpus(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        os, "sched_getaffinity", lambda pid: set(range(8)), raising=False
+    )
+
+    # No cgroup CPU quota
+    assert available_cpus(cgroup_root=str(tmp_path)) == 8
+    assert available_cpus("2", cgroup_root=str(tmp_path)) == 2
+    assert available_cpus("500m", cgroup_root=str(tmp_path)) == 1
+
+    # cgroup v1
+    (tmp_path / "cpu").mkdir()
+    (tmp_path / "cpu" / "cpu.cfs_period_us").write_text("100000\n")
+    (tmp_path / "cpu" / "cpu.cfs_quota_us").write_text("-1\n")
+    assert available_cpus(cgroup_root=str(tmp_path)) == 8
+    (tmp_path / "cpu" / "cpu.cfs_quota_us").write_text("300000\n")
+    assert available_cpus(cgroup_root=str(tmp_path)) == 3
+
+    # cgroup v2 takes precedence
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+    assert available_cpus(cgroup_root=str(tmp_path)) == 8
+    (tmp_path / "cpu.max").write_text("250000 100000\n")
+    assert available_cpus(cgroup_root=str(tmp_path)) == 2
+    assert available_cpus(1.5, cgroup_root=str(tmp_path)) == 1
+    assert available_cpus("4", cgroup_root=str(tmp_path)) == 2
+
+
+def test_nthread(monkeypatch):
+    monkeypatch.setattr(
+        os, "sched_getaffinity", lambda pid: set(range(8)), raising=False
+    )
+    monkeypatch.setenv("OMP_NUM_THREADS", "64")
+    config = XGBoostParameters(hyper_parameters=HyperParameters(verbosity=0))
+
+    # The task's CPU limit takes precedence over its request
+    xgboost_trainer = XGBoostTrainerTask(
+        name="test21",
+        config=config,
+        dataset_type=CSVFile,
+        requests=flytekit.Resources(cpu="2"),
+        limits=flytekit.Resources(cpu="3"),
+    )
+    params = xgboost_trainer.finalize_params(XGBoostParameters())
+    assert params.hyper_parameters.nthread == 3
+    # The configuration is left as it is, so that the threads are resolved again on every run
+    assert config.hyper_parameters.nthread == 0
+
+    params = xgboost_trainer.finalize_params(
+        XGBoostParameters(hyper_parameters=HyperParameters(nthread=5))
+    )
+    assert params.hyper_parameters.nthread == 5
+
+    monkeypatch.delenv("OPENBLAS_NUM_THREADS", raising=False)
+    with limit_threads(3):
+        assert os.environ["OMP_NUM_THREADS"] == "3"
+        assert os.environ["OPENBLAS_NUM_THREADS"] == "3"
+    # The environment is restored afterwards
+    assert os.environ["OMP_NUM_THREADS"] == "64"
+    assert "OPENBLAS_NUM_THREADS" not in os.environ
+
+    _, predictions, _ = xgboost_trainer.execute(
+        train=CSVFile("abalone_train.csv"),
+        test=CSVFile("abalone_test.csv"),
+        params=XGBoostParameters(),
+    )
+    assert np.load(predictions).shape == (
+        len(pd.read_csv("abalone_test.csv", header=None)),
+    )
+
+
+def test_shards(tmp_path):
+    # Every row of a file ends up in exactly one shard, in order
+    expected = pd.read_csv("abalone_train.csv", header=None).to_numpy(dtype=np.float32)
+    for world_size in [1, 3, 4, 7]:
+        shards = [
+            batches_dmatrix(
+                shard_batches("abalone_train.csv", "csv", 0, rank, world_size)
+            )
+            for rank in range(world_size)
+        ]
+        assert sum(shard.num_row() for shard in shards) == len(expected)
+        assert np.array_equal(
+            np.concatenate([shard.get_label() for shard in shards]), expected[:, 0]
+        )
+
+    # The rows of a FlyteSchema's Parquet files are cut into equal ranges, across row groups and files
+    directory = tmp_path / "schema"
+    directory.mkdir()
+    df = pd.DataFrame(expected, columns=[str(i) for i in range(expected.shape[1])])
+    df.iloc[:2000].to_parquet(directory / "00000", row_group_size=500)
+    df.iloc[2000:].to_parquet(directory / "00001", row_group_size=500)
+    # A single row group is split too
+    df.to_parquet(tmp_path / "single.parquet", row_group_size=len(df))
+    for path in [directory, tmp_path / "single.parquet"]:
+        shards = [
+            batches_dmatrix(shard_batches(path, "parquet", 0, rank, 4, batch_size=300))
+            for rank in range(4)
+        ]
+        assert [shard.num_row() for shard in shards] == [699, 700, 699, 700]
+        assert np.array_equal(
+            np.concatenate([shard.get_label() for shard in shards]), expected[:, 0]
+        )
+
+
+def test_distributed():
+    config = XGBoostParameters(
+        hyper_parameters=HyperParameters(max_depth=4, verbosity=0, tree_method="hist"),
+        model_parameters=ModelParameters(num_boost_round=20, verbose_eval=False),
+    )
+    trainers = {
+        num_workers: XGBoostTrainerTask(
+            name=f"test23-{num_workers}",
+            config=config,
+            dataset_type=CSVFile,
+            validate=True,
+            model_format="ubj",
+            num_workers=num_workers,
+        )
+        for num_workers in [1, 4]
+    }
+    labels = pd.read_csv("abalone_test.csv", header=None)[0].to_numpy()
+    results = {}
+    for num_workers, trainer in trainers.items():
+        model, predictions, evals_result = trainer.execute(
+            train=CSVFile("abalone_train.csv"),
+            validation=CSVFile("abalone_test.csv"),
+            test=CSVFile("abalone_test.csv"),
+            params=XGBoostParameters(),
+        )
+        rmse = np.sqrt(np.mean((np.load(predictions) - labels) ** 2))
+        results[num_workers] = (load_booster(model.download()), evals_result, rmse)
+
+    booster, evals_result, rmse = results[4]
+    assert booster.num_boosted_rounds() == 20
+    # The workers evaluate the model on the whole validation dataset, not only their shards
+    assert np.isclose(evals_result["validation"]["rmse"][-1], rmse, rtol=1e-3)
+    # The workers sketch the quantiles of their own shards, so the model can differ
+    # slightly from the one trained by a single process
+    assert rmse <= results[1][2] * 1.05
+
+    with pytest.raises(ValueError):
+        XGBoostTrainerTask(
+            name="test24", config=config, num_workers=2, quantile_dmatrix=True
+        )
+
+
+def test_dask(tmp_path):
+    pytest.importorskip("dask.distributed")
+    ParquetFile = FlyteFile[typing.TypeVar("parquet")]
+    for name in ["train", "test"]:
+        df = pd.read_csv(f"abalone_{name}.csv", header=None)
+        df.columns = [str(c) for c in df.columns]
+        df.to_parquet(tmp_path / f"{name}.parquet", row_group_size=500)
+
+    # Every row group is a partition, for the features and the labels alike
+    features, labels = read_parquet(tmp_path / "test.parquet", 0)
+    assert features.optimize().npartitions == labels.optimize().npartitions == 3
+
+    config = XGBoostParameters(
+        hyper_parameters=HyperParameters(max_depth=4, verbosity=0, tree_method="hist"),
+        model_parameters=ModelParameters(num_boost_round=10, verbose_eval=False),
+    )
+    csv_trainer = XGBoostTrainerTask(
+        name="test25", config=config, dataset_type=CSVFile, validate=True
+    )
+    dask_trainer = XGBoostTrainerTask(
+        name="test26",
+        config=config,
+        dataset_type=ParquetFile,
+        validate=True,
+        num_workers=2,
+        dask=True,
+    )
+    _, expected, expected_evals_result = csv_trainer.execute(
+        train=CSVFile("abalone_train.csv"),
+        validation=CSVFile("abalone_test.csv"),
+        test=CSVFile("abalone_test.csv"),
+        params=XGBoostParameters(),
+    )
+    model, predictions, evals_result = dask_trainer.execute(
+        train=ParquetFile(str(tmp_path / "train.parquet")),
+        validation=ParquetFile(str(tmp_path / "test.parquet")),
+        test=ParquetFile(str(tmp_path / "test.parquet")),
+        params=XGBoostParameters(),
+    )
+
+    assert joblib.load(model).num_boosted_rounds() == 10
+    # The predictions are written in the order of the test dataset
+    predictions = np.load(predictions)
+    assert predictions.dtype == np.float32
+    assert np.allclose(predictions, np.load(expected), rtol=1e-2, atol=0.1)
+    assert np.isclose(
+        evals_result["validation"]["rmse"][-1],
+        expected_evals_result["validation"]["rmse"][-1],
+        rtol=1e-2,
+    )
+
+    # FlyteSchema datasets are opened as a dask.dataframe too
+    schema_trainer = XGBoostTrainerTask(
+        name="test27",
+        config=config,
+        dataset_type=FlyteSchema,
+        num_workers=2,
+        quantile_dmatrix=True,
+        dask=True,
+    )
+
+    @task
+    def csv_to_df(data: str) -> pd.DataFrame:
+        return pd.read_csv(data, header=None, names=[str(i) for i in range(11)])
+
+    @workflow
+    def wf() -> NumpyFile:
+        _, schema_predictions, _ = schema_trainer(
+            train=csv_to_df(data="abalone_train.csv"),
+            test=csv_to_df(data="abalone_test.csv"),
+            params=XGBoostParameters(),
+        )
+        return schema_predictions
+
+    assert np.allclose(np.load(wf()), np.load(expected), rtol=1e-2, atol=0.1)
+
+    with pytest.raises(ValueError):
+        XGBoostTrainerTask(
+            name="test28", config=config, dask=True, external_memory=True
+        )
@@ -1,11 +1,13 @@
 from typing import Dict, List, NamedTuple
 
+import numpy as np
 import xgboost
 from flytekit import task, workflow
 from flytekit.types.file import FlyteFile, JoblibSerializedFile
 from flytekitplugins.xgboost import (
     HyperParameters,
     ModelParameters,
+    NumpyFile,
     XGBoostParameters,
     XGBoostTrainerTask,
 )
@@ -23,17 +25,12 @@ xgboost_trainer = XGBoostTrainerTask(
 
 
 @task
-def estimate_accuracy(predictions: List[float], test: FlyteFile) -> float:
+def estimate_accuracy(predictions: NumpyFile, test: FlyteFile) -> float:
     test.download()
-    dtest = xgboost.DMatrix(test.path)
+    dtest = xgboost.DMatrix(f"{test.path}?format=libsvm")
     labels = dtest.get_label()
-    return (
-        sum(
-            1 for i in range(len(predictions)) if int(predictions[i] > 0.5) == labels[i]
-        )
-        / float(len(predictions))
-        * 100.0
-    )
+    y_pred = np.load(predictions)
+    return float(np.mean((y_pred > 0.5) == labels)) * 100.0
 
 
 wf_output = NamedTuple(